@@ -1,18 +1,65 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, model_serializer
+from typing import Optional, List, Union, AsyncIterator
 from datetime import datetime, timezone, timedelta
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import os
+import json
+import orjson
+import time
+import stat
+import shutil
 import asyncio
+import threading
+import multiprocessing
+import mimetypes
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import logging
-from pymongo import MongoClient
+import anyio
+import anyio.to_thread
+from motor.motor_asyncio import AsyncIOMotorClient
+from motor.frameworks import asyncio as motor_asyncio_framework
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.monitoring import CommandListener, ConnectionPoolListener
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client import Counter as PromCounter
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from bson import ObjectId
+from bson.errors import InvalidId
 import uuid
 import hashlib
+import math
+import hmac
+import base64
+import zlib
+import struct
 import secrets
+import random
 import resend
 from dotenv import load_dotenv
 
+from PIL import Image, ImageOps
+
+try:
+    import boto3
+except ImportError:  # Only needed when STORAGE_BACKEND=s3
+    boto3 = None
+
+try:
+    import brotli
+except ImportError:  # Without it responses fall back to gzip
+    brotli = None
+
 # Load environment variables
 load_dotenv()
 
@@ -20,7 +67,622 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Fotos Express API")
+# MongoDB Connection
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "fotosexpress")
+APP_URL = os.environ.get("APP_URL", "https://photo-portal-13.preview.emergentagent.com")
+# ==================== POOL SIZING ====================
+# Every Motor operation runs on a thread from Motor's executor while it waits
+# for a pooled connection, so MOTOR_MAX_WORKERS caps Mongo concurrency as much
+# as MONGO_MAX_POOL_SIZE does. asyncio.to_thread (file I/O, S3, Resend) uses the
+# loop's default executor, and Starlette's run_in_threadpool (UploadFile, file
+# responses) has its own anyio token limiter. All of them are sized here and
+# instrumented so saturation shows up in /api/admin/pools.
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_CONNECTING = int(os.environ.get("MONGO_MAX_CONNECTING", "2"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0")) or None  # 0 waits forever
+MOTOR_MAX_WORKERS = int(os.environ.get("MOTOR_MAX_WORKERS", str((os.cpu_count() or 1) * 5)))
+THREADPOOL_WORKERS = int(os.environ.get("THREADPOOL_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+STARLETTE_THREAD_TOKENS = int(os.environ.get("STARLETTE_THREAD_TOKENS", "40"))
+
+class WaitStats:
+    """Count, total and worst-case wait; updated from driver and worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def summary(self) -> dict:
+        return {"count": self.count, "totalSeconds": round(self.total, 6), "maxSeconds": round(self.max, 6)}
+
+class MongoPoolMonitor(ConnectionPoolListener):
+    """Tracks pool occupancy and how long operations wait to check out a connection."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.cleared = 0
+        self.failures = Counter()
+        self.checkout_wait = WaitStats()
+
+    def _add(self, field: str, delta: int):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.in_use += 1
+        if event.duration is not None:
+            self.checkout_wait.record(event.duration)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.failures[event.reason] += 1
+        if event.reason == "timeout":
+            logger.warning(f"MongoDB pool checkout timed out after {event.duration:.3f}s; consider raising MONGO_MAX_POOL_SIZE")
+
+    def connection_checked_in(self, event):
+        self._add("in_use", -1)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def pool_cleared(self, event):
+        self._add("cleared", 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "open": self.open,
+            "inUse": self.in_use,
+            "waiting": self.waiting,
+            "cleared": self.cleared,
+            "checkoutFailures": dict(self.failures),
+            "checkoutWait": self.checkout_wait.summary(),
+        }
+
+class InstrumentedThreadPool(ThreadPoolExecutor):
+    """ThreadPoolExecutor that reports queue depth, busy workers and queue wait."""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.counts_lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.queue_wait = WaitStats()
+
+    def submit(self, fn, /, *args, **kwargs):
+        enqueued = time.perf_counter()
+        with self.counts_lock:
+            self.queued += 1
+
+        def run():
+            self.queue_wait.record(time.perf_counter() - enqueued)
+            with self.counts_lock:
+                self.queued -= 1
+                self.active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.counts_lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        return super().submit(run)
+
+    def stats(self) -> dict:
+        return {
+            "maxWorkers": self._max_workers,
+            "threads": len(self._threads),
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "queueWait": self.queue_wait.summary(),
+        }
+
+mongo_pool_monitor = MongoPoolMonitor()
+motor_executor = InstrumentedThreadPool(MOTOR_MAX_WORKERS, "motor")
+default_executor = InstrumentedThreadPool(THREADPOOL_WORKERS, "to_thread")
+# Motor sizes its executor from MOTOR_MAX_WORKERS at import time, before .env is
+# loaded; swap in our own so the setting works from .env and is instrumented.
+motor_asyncio_framework._EXECUTOR = motor_executor
+
+def starlette_thread_stats() -> dict:
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return {
+        "totalTokens": int(limiter.total_tokens),
+        "borrowedTokens": statistics.borrowed_tokens,
+        "tasksWaiting": statistics.tasks_waiting,
+    }
+
+# ==================== METRICS ====================
+# Prometheus metrics served at /metrics. HTTP metrics are labelled by route
+# template (/api/ambulant-clients/phone/{phone}), never by raw path, so label
+# cardinality stays bounded. Mongo command latency comes from a pymongo
+# CommandListener; pool, thread pool and reference cache figures are read at
+# scrape time from the objects that already track them.
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+http_requests_total = PromCounter(
+    "http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"]
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time until the response is fully sent", ["method", "route"]
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served")
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ["collection", "command"],
+    buckets=MONGO_LATENCY_BUCKETS,
+)
+mongo_command_failures = PromCounter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ["collection", "command"]
+)
+
+class MongoCommandMonitor(CommandListener):
+    """Times every command by collection and command name, and hands slow ones to the slow-query log."""
+
+    def __init__(self):
+        # (connection, request id) -> (collection, command name, command, database, route);
+        # entries live for one round trip
+        self.pending = {}
+
+    def started(self, event):
+        value = event.command.get(event.command_name)
+        collection = value if isinstance(value, str) else event.command.get("collection", "")
+        if not isinstance(collection, str):
+            collection = ""
+        # Listeners run in Motor's executor with the caller's context, so the route is visible here
+        route = current_route() if SLOW_QUERY_MS else None
+        self.pending[(event.connection_id, event.request_id)] = (
+            collection, event.command_name, event.command, event.database_name, route
+        )
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+    def _finished(self, event, failed: bool):
+        pending = self.pending.pop((event.connection_id, event.request_id), None)
+        if not pending:
+            return
+        collection, command_name, command, database, route = pending
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.labels(collection, command_name).observe(seconds)
+        if failed:
+            mongo_command_failures.labels(collection, command_name).inc()
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            slow_query_recorder.submit(collection, command_name, command, database, route, seconds * 1000)
+
+class RuntimeStatsCollector:
+    """Exposes pool, thread pool and reference cache counters at scrape time."""
+
+    def describe(self):
+        # Nothing to pre-register; collect() needs the running loop and the caches
+        return []
+
+    def collect(self):
+        pool = mongo_pool_monitor.stats()
+        for name, value, doc in (
+            ("mongodb_pool_connections_open", pool["open"], "Open pooled connections"),
+            ("mongodb_pool_connections_in_use", pool["inUse"], "Connections checked out"),
+            ("mongodb_pool_checkouts_waiting", pool["waiting"], "Operations waiting for a connection"),
+            ("mongodb_pool_max_size", pool["maxPoolSize"], "Configured maxPoolSize"),
+        ):
+            yield GaugeMetricFamily(name, doc, value=value)
+        wait = CounterMetricFamily("mongodb_pool_checkout_wait_seconds", "Total time spent waiting for a connection")
+        wait.add_metric([], pool["checkoutWait"]["totalSeconds"])
+        yield wait
+        checkouts = CounterMetricFamily("mongodb_pool_checkouts", "Successful connection checkouts")
+        checkouts.add_metric([], pool["checkoutWait"]["count"])
+        yield checkouts
+        failures = CounterMetricFamily("mongodb_pool_checkout_failures", "Failed checkouts by reason", labels=["reason"])
+        for reason, count in pool["checkoutFailures"].items():
+            failures.add_metric([str(reason)], count)
+        yield failures
+
+        labels = ["pool"]
+        queued = GaugeMetricFamily("threadpool_queued_tasks", "Tasks waiting for a worker thread", labels=labels)
+        active = GaugeMetricFamily("threadpool_active_tasks", "Tasks running on a worker thread", labels=labels)
+        workers = GaugeMetricFamily("threadpool_max_workers", "Configured worker threads", labels=labels)
+        queue_wait = CounterMetricFamily("threadpool_queue_wait_seconds", "Total time tasks spent queued", labels=labels)
+        for name, executor in (("motor", motor_executor), ("to_thread", default_executor)):
+            stats = executor.stats()
+            queued.add_metric([name], stats["queued"])
+            active.add_metric([name], stats["active"])
+            workers.add_metric([name], stats["maxWorkers"])
+            queue_wait.add_metric([name], stats["queueWait"]["totalSeconds"])
+        threads = starlette_thread_stats()
+        queued.add_metric(["starlette"], threads["tasksWaiting"])
+        active.add_metric(["starlette"], threads["borrowedTokens"])
+        workers.add_metric(["starlette"], threads["totalTokens"])
+        yield from (queued, active, workers, queue_wait)
+
+        hits = CounterMetricFamily("reference_cache_hits", "Reference cache reads served from memory", labels=["cache"])
+        misses = CounterMetricFamily("reference_cache_misses", "Reference cache reads that reloaded from Mongo", labels=["cache"])
+        ratio = GaugeMetricFamily("reference_cache_hit_ratio", "Hits over all reads since start", labels=["cache"])
+        for name, cache in REFERENCE_CACHES.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            reads = cache.hits + cache.misses
+            ratio.add_metric([name], cache.hits / reads if reads else 0.0)
+        yield from (hits, misses, ratio)
+
+def route_template(scope) -> str:
+    """Path template of the route that served (or would serve) this request"""
+    route = scope.get("route")
+    if route is None:
+        # Rejected before routing (e.g. by load shedding); match it ourselves
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """Outermost middleware, so throttled and shed requests are counted too."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "OTHER"
+        started = time.perf_counter()
+        http_requests_in_flight.inc()
+        token = request_scope.set(scope)  # Lets the slow-query log name the calling route
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_scope.reset(token)
+            http_requests_in_flight.dec()
+            route = route_template(scope)
+            http_request_duration.labels(method, route).observe(time.perf_counter() - started)
+            http_requests_total.labels(method, route, str(status)).inc()
+
+mongo_command_monitor = MongoCommandMonitor()
+REGISTRY.register(RuntimeStatsCollector())
+
+# Motor connects lazily and binds to the running event loop on first use;
+# the lifespan below verifies connectivity on startup and closes it on shutdown.
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxConnecting=MONGO_MAX_CONNECTING,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[mongo_pool_monitor, mongo_command_monitor],
+)
+db = client[DB_NAME]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    asyncio.get_running_loop().set_default_executor(default_executor)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = STARLETTE_THREAD_TOKENS
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        logger.warning(f"MongoDB not reachable at startup: {e}")
+    await ensure_indexes()
+    if SLOW_QUERY_MS:
+        await ensure_slow_query_collection()
+        slow_query_recorder.attach(asyncio.get_running_loop())
+    spawn_background(run_migration("denormalized_names", backfill_denormalized_names))
+    spawn_background(maintain_phone_filter())
+    spawn_background(collect_stale_upload_sessions())
+    spawn_background(sweep_orphan_photos())
+    if RESEND_API_KEY:
+        for _ in range(EMAIL_WORKERS):
+            spawn_background(email_outbox_worker())
+    global derivative_pool
+    # Motor, the executors and the background tasks already run threads; forking them can deadlock the child
+    derivative_pool = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    yield
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    derivative_pool.shutdown(wait=False, cancel_futures=True)
+    client.close()
+
+app = FastAPI(title="Fotos Express API", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# ==================== COMPRESSION ====================
+# JSON lists with photo URLs compress 5-10x, which matters on venue Wi-Fi.
+# Responses are compressed with brotli or gzip, whichever the client prefers
+# in Accept-Encoding. Photos and ZIP archives are already compressed, so they
+# are never touched, and neither is anything smaller than the minimum size.
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "4"))  # 0-11; low levels suit per-request compression
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+UNCOMPRESSED_PATH_PREFIXES = ("/api/photos/",)
+UNCOMPRESSED_PATH_SUFFIXES = ("/photos.zip",)
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q-values"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    candidates = [("br", 2), ("gzip", 1)] if brotli else [("gzip", 1)]
+    best = max(candidates, key=lambda c: (weights.get(c[0], wildcard), c[1]))[0]
+    return best if weights.get(best, wildcard) > 0 else None
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.finish = self.compressor.process, self.compressor.finish
+            self.flush = self.compressor.flush
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+            self.compress, self.finish = self.compressor.compress, self.compressor.flush
+            self.flush = lambda: self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class CompressionMiddleware:
+    """Pure ASGI compression; streamed bodies are flushed chunk by chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path.startswith(UNCOMPRESSED_PATH_PREFIXES) or path.endswith(UNCOMPRESSED_PATH_SUFFIXES):
+            return await self.app(scope, receive, send)
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), "")
+        encoding = negotiate_encoding(accept) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+            if start is not None:
+                initial, start = start, None
+                headers = MutableHeaders(raw=initial["headers"])
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" in headers
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or (len(body) < COMPRESSION_MIN_SIZE and not more_body)
+                ):
+                    await send(initial)
+                    return await send(message)
+                compressor = StreamCompressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers and not headers["etag"].startswith("W/"):
+                    # The compressed bytes differ, so a strong tag no longer identifies them
+                    headers["ETag"] = "W/" + headers["etag"]
+                if more_body:
+                    del headers["Content-Length"]
+                    body = compressor.compress(body) + compressor.flush()
+                else:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                await send(initial)
+                return await send({"type": "http.response.body", "body": body, "more_body": more_body})
+            if compressor is None:
+                return await send(message)
+            more_body = message.get("more_body", False)
+            body = compressor.compress(message.get("body", b""))
+            body += compressor.flush() if more_body else compressor.finish()
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware)
+
+# ==================== LOAD SHEDDING ====================
+# Public lookup and registration endpoints are unauthenticated, so a single
+# scripted client or a refresh storm at a venue must not be able to starve
+# everyone else. Each route group can get a per-IP token bucket (capacity =
+# burst, refilled at RATE_LIMIT_<GROUP>_PER_MINUTE; the limits are opt-in and
+# 0 leaves the group unlimited), and a global cap on in-flight requests sheds
+# load with 503 + Retry-After once the wait queue is full.
+RATE_LIMITS = {
+    group: (
+        float(os.environ.get(f"RATE_LIMIT_{group.upper()}_PER_MINUTE", "0")),
+        int(os.environ.get(f"RATE_LIMIT_{group.upper()}_BURST", burst)),
+    )
+    for group, burst in (("lookup", "30"), ("registration", "20"), ("admin", "60"))
+}
+RATE_LIMIT_MAX_CLIENTS = int(os.environ.get("RATE_LIMIT_MAX_CLIENTS", "50000"))  # Buckets kept per group (LRU)
+# Proxies appending to X-Forwarded-For; the deployment sits behind one ingress (0 = uvicorn exposed directly)
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "64"))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "128"))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("QUEUE_TIMEOUT_SECONDS", "2"))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.environ.get("LOAD_SHED_RETRY_AFTER_SECONDS", "2"))
+# Downloads hold a connection as long as the guest's network needs; signed URLs already gate them
+UNCAPPED_PATH_PREFIXES = ("/api/health", "/metrics", "/api/photos/")
+UNCAPPED_PATH_SUFFIXES = ("/photos.zip",)
+# Uploads and exports last as long as their body or stream, so they get their own slots
+MAX_CONCURRENT_STREAMS = int(os.environ.get("MAX_CONCURRENT_STREAMS", "8"))
+
+def is_streaming_request(method: str, path: str) -> bool:
+    return (
+        path.startswith("/api/export/")
+        or (method == "PATCH" and path.startswith("/api/uploads/"))
+        or (method == "POST" and path.endswith("/photos/upload"))
+    )
+
+def rate_limit_group(method: str, path: str) -> Optional[str]:
+    """Map a request onto the token-bucket group that limits it, if any."""
+    if path.startswith(("/api/admin/", "/api/export/", "/api/staff/approve/")) or path == "/api/seed":
+        return "admin"
+    if method == "GET" and (
+        path == "/api/clients/lookup"
+        or path.startswith(("/api/ambulant-clients/phone/", "/api/activity-clients/phone/"))
+    ):
+        return "lookup"
+    if method == "POST" and path in (
+        "/api/ambulant-clients", "/api/activity-clients", "/api/services", "/api/staff",
+        "/api/staff/login", "/api/staff/activate",
+    ):
+        return "registration"
+    return None
+
+def client_ip(scope) -> str:
+    if TRUSTED_PROXY_HOPS:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                hops = [hop.strip() for hop in value.decode("latin-1").split(",") if hop.strip()]
+                if hops:
+                    return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+class TokenBuckets:
+    """Per-key token buckets with LRU eviction so memory stays bounded."""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: OrderedDict = OrderedDict()
+
+    def take(self, key: str) -> int:
+        """Spend one token; return 0 when allowed, else seconds until the next token."""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return 0 if allowed else max(1, math.ceil((1 - tokens) / self.rate))
+
+rate_limiters = {
+    group: TokenBuckets(per_minute, burst, RATE_LIMIT_MAX_CLIENTS)
+    for group, (per_minute, burst) in RATE_LIMITS.items()
+    if per_minute > 0 and burst > 0
+}
+
+class LoadSheddingMiddleware:
+    """Pure ASGI middleware, so streamed bodies pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+        self.slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self.stream_slots = asyncio.Semaphore(MAX_CONCURRENT_STREAMS)
+        self.queued = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        group = rate_limit_group(scope["method"], path)
+        limiter = rate_limiters.get(group)
+        if limiter:
+            retry_after = limiter.take(client_ip(scope))
+            if retry_after:
+                response = JSONResponse(
+                    {"detail": "Too many requests"}, status_code=429,
+                    headers={"Retry-After": str(retry_after)},
+                )
+                return await response(scope, receive, send)
+        if path.startswith(UNCAPPED_PATH_PREFIXES) or path.endswith(UNCAPPED_PATH_SUFFIXES):
+            return await self.app(scope, receive, send)
+        slots = self.stream_slots if is_streaming_request(scope["method"], path) else self.slots
+        if not await self.acquire(slots):
+            return await self.shed(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            slots.release()
+
+    async def acquire(self, slots: asyncio.Semaphore) -> bool:
+        if not slots.locked():
+            await slots.acquire()
+            return True
+        if self.queued >= MAX_QUEUED_REQUESTS:
+            return False
+        self.queued += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), QUEUE_TIMEOUT_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.queued -= 1
+
+    async def shed(self, scope, receive, send):
+        logger.warning(f"Shedding {scope['method']} {scope['path']}: {self.queued} requests queued")
+        response = JSONResponse(
+            {"detail": "Server busy, try again shortly"}, status_code=503,
+            headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)},
+        )
+        await response(scope, receive, send)
+
+# Added before CORS so throttled responses still carry CORS headers
+app.add_middleware(LoadSheddingMiddleware)
 
 # CORS
 app.add_middleware(
@@ -29,20 +691,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag", "Upload-Offset", "Upload-Length", "Location", "Content-Range", "Content-Disposition", "Retry-After"],
 )
 
-# MongoDB Connection
-MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
-DB_NAME = os.environ.get("DB_NAME", "fotosexpress")
-APP_URL = os.environ.get("APP_URL", "https://photo-portal-13.preview.emergentagent.com")
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+# Added last so it wraps everything, including CORS preflights and throttled requests
+app.add_middleware(MetricsMiddleware)
 
 # Resend Configuration
 RESEND_API_KEY = os.environ.get("RESEND_API_KEY")
 SENDER_EMAIL = os.environ.get("SENDER_EMAIL", "onboarding@resend.dev")
+RESEND_API_URL = os.environ.get("RESEND_API_URL")  # Point at a fake Resend server in tests
 if RESEND_API_KEY:
     resend.api_key = RESEND_API_KEY
+if RESEND_API_URL:
+    resend.api_url = RESEND_API_URL.rstrip("/")
 
 # Collections
 zones_collection = db["zones"]  # Zonas ambulantes
@@ -53,6 +715,1277 @@ activity_clients_collection = db["activity_clients"]  # Clientes de actividades
 service_requests_collection = db["service_requests"]
 staff_applications_collection = db["staff_applications"]
 staff_users_collection = db["staff_users"]
+catalog_versions_collection = db["catalog_versions"]  # Change counters for cached reference collections
+photos_collection = db["photos"]  # Content-addressed photo objects with reference counts
+email_outbox_collection = db["email_outbox"]  # Emails waiting for the outbox workers
+migrations_collection = db["migrations"]  # One document per one-off data migration already applied
+
+# ==================== INDEXES ====================
+
+# Every query filter used by the endpoints must be covered here
+INDEX_REGISTRY = {
+    "zones": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "businesses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "activities": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("negocioId", ASCENDING)], name="negocioId"),
+    ],
+    "ambulant_clients": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("telefonoE164", ASCENDING)], name="telefonoE164"),
+        IndexModel([("zonaId", ASCENDING), ("_id", ASCENDING)], name="zonaId_id"),
+        IndexModel([("fotosArchivos.key", ASCENDING)], name="fotosArchivos_key"),
+    ],
+    "activity_clients": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("telefonoE164", ASCENDING), ("negocioId", ASCENDING), ("actividadId", ASCENDING)], name="telefonoE164_negocio_actividad"),
+        IndexModel([("actividadId", ASCENDING), ("_id", ASCENDING)], name="actividadId_id"),
+        IndexModel([("negocioId", ASCENDING)], name="negocioId"),
+        IndexModel([("fotosArchivos.key", ASCENDING)], name="fotosArchivos_key"),
+    ],
+    "photos": [
+        IndexModel([("refcount", ASCENDING), ("updatedAt", ASCENDING)], name="refcount_updatedAt"),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("nextAttemptAt", ASCENDING)], name="status_nextAttemptAt"),
+        IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+    ],
+    "service_requests": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "staff_applications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "staff_users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Tokens are cleared to None on activation, so only enforce uniqueness on real tokens
+        IndexModel(
+            [("activationToken", ASCENDING)], name="activationToken_unique", unique=True,
+            partialFilterExpression={"activationToken": {"$type": "string"}}
+        ),
+        IndexModel([("isActive", ASCENDING), ("_id", ASCENDING)], name="isActive_id"),
+    ],
+}
+
+async def ensure_indexes():
+    """Apply INDEX_REGISTRY. create_indexes is idempotent, so this is safe on every startup."""
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except Exception as e:
+            # A bad index (e.g. duplicates violating a unique constraint) must not block startup
+            logger.error(f"Index creation failed for {collection_name}: {e}")
+
+# ==================== SLOW QUERY LOG ====================
+# Any Mongo command slower than SLOW_QUERY_MS is written to the capped
+# slow_queries collection together with the route that issued it, the shape of
+# its filter (values replaced by "?") and an explain() summary. The summary
+# says whether it was a COLLSCAN or an IXSCAN and how many documents were
+# examined versus returned. Explains run in the background, and a given query
+# shape is explained at most once per SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS, so
+# a storm of slow queries cannot double the load.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))  # 0 disables the log
+SLOW_QUERY_CAP_BYTES = int(os.environ.get("SLOW_QUERY_CAP_BYTES", str(16 * 1024 * 1024)))
+SLOW_QUERY_MAX_DOCS = int(os.environ.get("SLOW_QUERY_MAX_DOCS", "5000"))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "300"))
+SLOW_QUERY_MAX_PENDING = int(os.environ.get("SLOW_QUERY_MAX_PENDING", "16"))
+SLOW_QUERY_COLLECTION = "slow_queries"
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Session and transport fields the driver adds that explain does not accept
+EXPLAIN_STRIPPED_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern", "$clusterTime", "$db", "$readPreference"}
+
+slow_queries_collection = db[SLOW_QUERY_COLLECTION]
+mongo_slow_commands = PromCounter(
+    "mongodb_slow_commands_total", "Commands slower than SLOW_QUERY_MS", ["collection", "command"]
+)
+request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+def current_route() -> Optional[str]:
+    """Method and route template of the request running in this context"""
+    scope = request_scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route else scope['path']}"
+
+def query_shape(value):
+    """Replace literal values with "?" so equal queries with different data group together"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]  # $and / $or branches, pipeline stages
+        return ["?"] if value else []
+    return "?"
+
+def command_filter(command_name: str, command: dict):
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "update":
+        return command["updates"][0].get("q", {}) if command.get("updates") else None
+    if command_name == "delete":
+        return command["deletes"][0].get("q", {}) if command.get("deletes") else None
+    if command_name == "aggregate":
+        return command.get("pipeline", [])
+    return None
+
+def explain_command(command_name: str, command: dict) -> Optional[dict]:
+    """The command to pass to explain, or None when it cannot be explained safely"""
+    if command_name not in EXPLAINABLE_COMMANDS:
+        return None
+    if command_name == "aggregate" and any("$out" in stage or "$merge" in stage for stage in command.get("pipeline", [])):
+        return None
+    explained = {key: value for key, value in command.items() if key not in EXPLAIN_STRIPPED_FIELDS}
+    # explain accepts a single write statement
+    for batch in ("updates", "deletes"):
+        if batch in explained:
+            explained[batch] = explained[batch][:1]
+    return explained
+
+def find_key(node, key: str):
+    """First value stored under `key` anywhere in a nested explain document"""
+    if isinstance(node, dict):
+        if key in node:
+            return node[key]
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+def summarize_explain(explain: dict) -> dict:
+    stages, indexes = [], []
+
+    def walk(plan):
+        if not isinstance(plan, dict):
+            return
+        if plan.get("stage"):
+            stages.append(plan["stage"])
+        if plan.get("indexName"):
+            indexes.append(plan["indexName"])
+        for key in ("queryPlan", "inputStage", "thenStage", "elseStage", "outerStage", "innerStage"):
+            walk(plan.get(key))
+        for child in plan.get("inputStages", []):
+            walk(child)
+
+    walk(find_key(explain, "winningPlan"))
+    stats = find_key(explain, "executionStats") or {}
+    if "COLLSCAN" in stages:
+        plan = "COLLSCAN"
+    elif any(stage.endswith("IXSCAN") for stage in stages):
+        plan = "IXSCAN"
+    else:
+        plan = stages[-1] if stages else None
+    return {
+        "plan": plan,
+        "stages": stages,
+        "indexes": indexes,
+        "docsExamined": stats.get("totalDocsExamined"),
+        "keysExamined": stats.get("totalKeysExamined"),
+        "nReturned": stats.get("nReturned"),
+        "executionTimeMillis": stats.get("executionTimeMillis"),
+    }
+
+class SlowQueryRecorder:
+    """Moves slow commands from driver threads onto the event loop and records them there."""
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pending = 0
+        self.dropped = 0
+        self.explained = {}  # shape key -> (monotonic time, summary)
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def submit(self, collection: str, command_name: str, command: dict, database: str, route: Optional[str], duration_ms: float):
+        """Called from the command listener; never blocks the driver thread"""
+        if collection == SLOW_QUERY_COLLECTION or command_name == "explain" or self.loop is None:
+            return
+        mongo_slow_commands.labels(collection, command_name).inc()
+        try:
+            self.loop.call_soon_threadsafe(self._start, collection, command_name, command, database, route, duration_ms)
+        except RuntimeError:  # Loop already closed during shutdown
+            pass
+
+    def _start(self, *args):
+        if self.pending >= SLOW_QUERY_MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending += 1
+        spawn_background(self._record(*args))
+
+    async def _record(self, collection, command_name, command, database, route, duration_ms):
+        try:
+            command_query = command_filter(command_name, command)
+            filter_json = orjson.dumps(query_shape(command_query)).decode() if command_query is not None else None
+            sort = command.get("sort")
+            entry = {
+                "id": generate_id("SQ"),
+                "at": datetime.now(timezone.utc),
+                "database": database,
+                "collection": collection,
+                "command": command_name,
+                "durationMs": round(duration_ms, 3),
+                "route": route,
+                "filter": filter_json,
+                "sort": orjson.dumps(sort, default=str).decode() if sort else None,
+                "explain": None,
+            }
+            to_explain = explain_command(command_name, command)
+            if to_explain is not None:
+                key = (database, collection, command_name, filter_json, entry["sort"])
+                cached = self.explained.get(key)
+                if cached and time.monotonic() - cached[0] < SLOW_QUERY_EXPLAIN_INTERVAL:
+                    entry["explain"] = cached[1]
+                else:
+                    try:
+                        explain = await client[database].command(
+                            {"explain": to_explain, "verbosity": "executionStats"}
+                        )
+                        entry["explain"] = summarize_explain(explain)
+                        if len(self.explained) >= SLOW_QUERY_MAX_DOCS:
+                            self.explained.clear()
+                        self.explained[key] = (time.monotonic(), entry["explain"])
+                    except Exception as e:
+                        entry["explainError"] = str(e)
+            plan = entry["explain"]["plan"] if entry["explain"] else "no plan"
+            logger.warning(f"Slow {command_name} on {collection} ({duration_ms:.0f} ms, {plan}) from {route or 'background'}: {filter_json}")
+            await slow_queries_collection.insert_one(entry)
+        except Exception as e:
+            logger.error(f"Recording slow query on {collection} failed: {e}")
+        finally:
+            self.pending -= 1
+
+slow_query_recorder = SlowQueryRecorder()
+
+async def ensure_slow_query_collection():
+    """Create the capped slow_queries collection once; newest entries push out the oldest"""
+    try:
+        await db.create_collection(SLOW_QUERY_COLLECTION, capped=True, size=SLOW_QUERY_CAP_BYTES, max=SLOW_QUERY_MAX_DOCS)
+    except CollectionInvalid:
+        options = await slow_queries_collection.options()
+        if not options.get("capped"):
+            logger.warning(f"{SLOW_QUERY_COLLECTION} exists but is not capped; it will grow without bound")
+    except Exception as e:
+        logger.error(f"Could not create {SLOW_QUERY_COLLECTION}: {e}")
+
+# ==================== REFERENCE DATA CACHE ====================
+
+REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL_SECONDS", "60"))
+
+class ReferenceCache:
+    """In-process snapshot of a small reference collection, keyed by id, refreshed on mark_changed() or TTL"""
+
+    def __init__(self, collection, ttl: float = REFERENCE_CACHE_TTL):
+        self.collection = collection
+        self.name = collection.name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._docs: dict = {}
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    async def _ensure_loaded(self):
+        if self._is_fresh():
+            self.hits += 1
+            return
+        async with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return
+            self.misses += 1
+            generation = self._generation
+            # Writers update documents before bumping the counter, so read in the opposite order
+            version_doc = await catalog_versions_collection.find_one({"_id": self.name})
+            docs = await self.collection.find({}, {"_id": 0}).sort("_id", ASCENDING).to_list(length=None)
+            self._docs = {d["id"]: d for d in docs}
+            self.version = version_doc["version"] if version_doc else 0
+            # An invalidate() during the reload means the snapshot may already be stale
+            if generation == self._generation:
+                self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._generation += 1
+        self._loaded_at = 0.0
+
+    async def mark_changed(self):
+        """Bump the shared change counter (so every worker's ETags change) and drop the local snapshot"""
+        await catalog_versions_collection.update_one({"_id": self.name}, {"$inc": {"version": 1}}, upsert=True)
+        self.invalidate()
+
+    async def get_version(self) -> int:
+        await self._ensure_loaded()
+        return self.version
+
+    async def get(self, doc_id: Optional[str]) -> Optional[dict]:
+        await self._ensure_loaded()
+        doc = self._docs.get(doc_id)
+        return dict(doc) if doc else None
+
+    async def find(self, predicate=None) -> list:
+        await self._ensure_loaded()
+        return [dict(d) for d in self._docs.values() if predicate is None or predicate(d)]
+
+    async def names(self) -> dict:
+        await self._ensure_loaded()
+        return {doc_id: d.get("nombre") for doc_id, d in self._docs.items()}
+
+zones_cache = ReferenceCache(zones_collection)
+businesses_cache = ReferenceCache(businesses_collection)
+activities_cache = ReferenceCache(activities_collection)
+REFERENCE_CACHES = {"zones": zones_cache, "businesses": businesses_cache, "activities": activities_cache}
+
+# ==================== CATALOG ETAGS ====================
+
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE_SECONDS", "60"))
+
+async def catalog_etag(variant: str, *caches: ReferenceCache) -> str:
+    """Weak ETag built from the change counters of every collection the payload depends on"""
+    versions = [f"{cache.name}.{await cache.get_version()}" for cache in caches]
+    return f'W/"{"-".join(versions)}-{variant}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison: W/"x" and "x" name the same representation
+    strip_weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+    return "*" in candidates or strip_weak(etag) in {strip_weak(tag) for tag in candidates}
+
+def catalog_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={CATALOG_MAX_AGE}, must-revalidate"}
+
+# ==================== DENORMALIZED NAMES ====================
+
+# Parent names copied onto clients at insert: (parent cache, client collection, foreign key, denormalized field)
+DENORMALIZED_NAMES = [
+    (zones_cache, ambulant_clients_collection, "zonaId", "zonaNombre"),
+    (businesses_cache, activity_clients_collection, "negocioId", "negocioNombre"),
+    (activities_cache, activity_clients_collection, "actividadId", "actividadNombre"),
+]
+
+background_tasks = set()
+
+def spawn_background(coro):
+    """Run a coroutine outside the request, keeping a reference so it is not garbage-collected"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def fan_out_name(collection, foreign_key: str, field: str, parent_id: str, nombre: str):
+    """Propagate a renamed parent to its clients, again after the cache TTL for workers still inserting the old name"""
+    for attempt in range(2):
+        try:
+            result = await collection.update_many(
+                {foreign_key: parent_id, field: {"$ne": nombre}},
+                {"$set": {field: nombre}}
+            )
+            if result.modified_count:
+                logger.info(f"Updated {field} on {result.modified_count} {collection.name} documents")
+        except Exception as e:
+            logger.error(f"Fan-out of {field} for {parent_id} failed: {e}")
+        if attempt == 0:
+            await asyncio.sleep(REFERENCE_CACHE_TTL)
+
+def schedule_name_fan_out(cache: ReferenceCache, parent_id: str, nombre: str):
+    for parent_cache, collection, foreign_key, field in DENORMALIZED_NAMES:
+        if parent_cache is cache:
+            spawn_background(fan_out_name(collection, foreign_key, field, parent_id, nombre))
+
+MIGRATION_BATCH_SIZE = 1000
+
+async def run_migration(name: str, migrate):
+    """Apply an idempotent one-off data migration unless its marker document shows it already ran"""
+    if await migrations_collection.find_one({"_id": name}, {"_id": 1}):
+        return
+    try:
+        await migrate()
+    except Exception as e:
+        logger.error(f"Migration {name} failed: {e}")
+        return
+    await migrations_collection.update_one(
+        {"_id": name}, {"$set": {"appliedAt": datetime.now(timezone.utc)}}, upsert=True
+    )
+    logger.info(f"Migration {name} applied")
+
+async def backfill_field(collection, field: str, projection: dict, value):
+    """Set `field` to value(doc) on every document missing it, in unordered bulk_write batches"""
+    batch = []
+    async for doc in collection.find({field: {"$exists": False}}, projection):
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: value(doc)}}))
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            await collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.bulk_write(batch, ordered=False)
+
+async def backfill_denormalized_names():
+    """Fill names on client documents written before they were denormalized"""
+    for cache, collection, foreign_key, field in DENORMALIZED_NAMES:
+        names = await cache.names()
+        # Orphans whose parent no longer exists get "N/A"
+        await backfill_field(collection, field, {"_id": 1, foreign_key: 1}, lambda doc: names.get(doc.get(foreign_key), "N/A"))
+
+# ==================== PHONE LOOKUP ====================
+
+# Lookups query the E.164 `telefonoE164`; a Bloom filter answers misses without Mongo.
+# Phones registered on another worker can 404 until the next sync (PHONE_FILTER_SYNC_SECONDS).
+DEFAULT_PHONE_COUNTRY_CODE = os.environ.get("DEFAULT_PHONE_COUNTRY_CODE", "1")  # Puerto Rico / NANP
+PHONE_NATIONAL_DIGITS = int(os.environ.get("PHONE_NATIONAL_DIGITS", "10"))  # Longer numbers already carry a country code
+PHONE_FILTER_CAPACITY = int(os.environ.get("PHONE_FILTER_CAPACITY", "100000"))
+PHONE_FILTER_ERROR_RATE = float(os.environ.get("PHONE_FILTER_ERROR_RATE", "0.01"))
+PHONE_FILTER_SYNC_INTERVAL = float(os.environ.get("PHONE_FILTER_SYNC_SECONDS", "5"))
+PHONE_FILTER_REBUILD_INTERVAL = float(os.environ.get("PHONE_FILTER_REBUILD_SECONDS", "3600"))
+# Other processes insert with their own clocks; re-reading this far back
+# covers ObjectIds that sort slightly before our last sync
+PHONE_FILTER_SYNC_MARGIN = 30
+PHONE_COLLECTIONS = (ambulant_clients_collection, activity_clients_collection)
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """E.164 form of a phone as typed ("(787) 123-4567", "+1 787.123.4567", "001 787..."), or None"""
+    if not raw:
+        return None
+    raw = raw.strip()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) <= PHONE_NATIONAL_DIGITS:
+        digits = DEFAULT_PHONE_COUNTRY_CODE + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return f"+{digits}"
+
+class PhoneFilter:
+    """Bloom filter of E.164 phones: no false negatives for what was added, PHONE_FILTER_ERROR_RATE false positives"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, phone: str):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(phone.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, phone: str):
+        for position in self._positions(phone):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, phone: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(phone))
+
+phone_filter: Optional[PhoneFilter] = None  # None until the first build; lookups then always query Mongo
+phone_filter_synced_at: Optional[datetime] = None
+phone_filter_built_at = 0.0
+
+def remember_phone(phone: Optional[str]):
+    if phone and phone_filter is not None:
+        phone_filter.add(phone)
+
+def phone_may_exist(phone: Optional[str]) -> bool:
+    return phone is not None and (phone_filter is None or phone in phone_filter)
+
+async def add_phones_since(target: PhoneFilter, since: Optional[datetime]):
+    query = {"_id": {"$gte": ObjectId.from_datetime(since)}} if since else {}
+    for collection in PHONE_COLLECTIONS:
+        async for doc in collection.find(query, {"_id": 0, "telefonoE164": 1}):
+            if doc.get("telefonoE164"):
+                target.add(doc["telefonoE164"])
+
+async def build_phone_filter():
+    """Load every known phone into a fresh filter and swap it in"""
+    global phone_filter, phone_filter_synced_at, phone_filter_built_at
+    started = datetime.now(timezone.utc)
+    counts = await asyncio.gather(*(c.estimated_document_count() for c in PHONE_COLLECTIONS))
+    fresh = PhoneFilter(max(PHONE_FILTER_CAPACITY, 2 * sum(counts)), PHONE_FILTER_ERROR_RATE)
+    await add_phones_since(fresh, None)
+    phone_filter, phone_filter_synced_at, phone_filter_built_at = fresh, started, time.monotonic()
+
+async def sync_phone_filter():
+    """Pick up clients inserted by other processes since the last sync"""
+    global phone_filter_synced_at
+    started = datetime.now(timezone.utc)
+    await add_phones_since(phone_filter, phone_filter_synced_at - timedelta(seconds=PHONE_FILTER_SYNC_MARGIN))
+    phone_filter_synced_at = started
+
+async def backfill_phone_numbers():
+    """Fill telefonoE164 on client documents written before it existed"""
+    for collection in PHONE_COLLECTIONS:
+        await backfill_field(collection, "telefonoE164", {"_id": 1, "telefono": 1}, lambda doc: normalize_phone(doc.get("telefono")))
+
+async def maintain_phone_filter():
+    await run_migration("phone_numbers", backfill_phone_numbers)
+    while True:
+        try:
+            if phone_filter is None or time.monotonic() - phone_filter_built_at > PHONE_FILTER_REBUILD_INTERVAL:
+                # Rebuilding also drops the phones of deleted clients
+                await build_phone_filter()
+            else:
+                await sync_phone_filter()
+        except Exception as e:
+            logger.error(f"Phone filter refresh failed: {e}")
+        await asyncio.sleep(PHONE_FILTER_SYNC_INTERVAL)
+
+# ==================== PHOTO STORAGE ====================
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")  # local | s3
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "media"))
+PHOTO_BASE_URL = os.environ.get("PHOTO_BASE_URL", f"{APP_URL}/api/photos")
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_PHOTO_BYTES = int(os.environ.get("MAX_PHOTO_BYTES", str(50 * 1024 * 1024)))
+S3_BUCKET = os.environ.get("S3_BUCKET", "fotosexpress")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_PUBLIC_URL = os.environ.get("S3_PUBLIC_URL")  # Serve straight from the bucket/CDN when set
+S3_PART_SIZE = max(int(os.environ.get("S3_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+PHOTO_STAGING_DIR = os.environ.get("PHOTO_STAGING_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads", "staging"))
+PHOTO_ORPHAN_GRACE = int(os.environ.get("PHOTO_ORPHAN_GRACE_SECONDS", "3600"))
+PHOTO_RECLAIM_WAIT = 30  # Seconds an upload waits for the sweeper to finish deleting the same bytes
+PHOTO_SWEEP_INTERVAL = int(os.environ.get("PHOTO_SWEEP_INTERVAL_SECONDS", "900"))
+
+class LocalStorage:
+    """Objects stored as files under MEDIA_ROOT, written to a temporary file and renamed into place"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise HTTPException(status_code=400, detail="Invalid object key")
+        return path
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> int:
+        path = self.path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        size = 0
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+            await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            f.close()
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+            raise
+        return size
+
+    async def put_file(self, key: str, source_path: str, content_type: Optional[str] = None):
+        """Move a finished local file into place (a rename when on the same filesystem)"""
+        path = self.path(key)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+        await asyncio.to_thread(shutil.move, source_path, path)
+
+    async def open(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Yield the object's bytes in [start, end) as UPLOAD_CHUNK_SIZE chunks"""
+        f = await asyncio.to_thread(open, self.path(key), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = UPLOAD_CHUNK_SIZE if remaining is None else min(UPLOAD_CHUNK_SIZE, remaining)
+                chunk = await asyncio.to_thread(f.read, size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self.path(key))
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(_remove_quietly, self.path(key))
+
+    def url(self, key: str) -> str:
+        return f"{PHOTO_BASE_URL}/{key}"
+
+class S3Storage:
+    """Objects stored in an S3-compatible bucket (AWS S3, MinIO), uploaded in S3_PART_SIZE multipart parts"""
+
+    def __init__(self, bucket: str):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3")
+        self.bucket = bucket
+        self.s3 = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+
+    async def save(self, key: str, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> int:
+        extra = {"ContentType": content_type} if content_type else {}
+        upload = await asyncio.to_thread(self.s3.create_multipart_upload, Bucket=self.bucket, Key=key, **extra)
+        upload_id = upload["UploadId"]
+        parts = []
+        buffer = bytearray()
+        size = 0
+
+        async def flush():
+            part_number = len(parts) + 1
+            result = await asyncio.to_thread(
+                self.s3.upload_part, Bucket=self.bucket, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=bytes(buffer)
+            )
+            parts.append({"ETag": result["ETag"], "PartNumber": part_number})
+            buffer.clear()
+
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                size += len(chunk)
+                if len(buffer) >= S3_PART_SIZE:
+                    await flush()
+            if buffer or not parts:
+                await flush()
+            await asyncio.to_thread(
+                self.s3.complete_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            await asyncio.to_thread(self.s3.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+        return size
+
+    async def put_file(self, key: str, source_path: str, content_type: Optional[str] = None):
+        await self.save(key, iter_file(source_path), content_type)
+
+    async def open(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        extra = {}
+        if start or end is not None:
+            extra["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        obj = await asyncio.to_thread(self.s3.get_object, Bucket=self.bucket, Key=key, **extra)
+        body = obj["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def exists(self, key: str) -> bool:
+        try:
+            await asyncio.to_thread(self.s3.head_object, Bucket=self.bucket, Key=key)
+            return True
+        except self.s3.exceptions.ClientError:
+            return False
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.s3.delete_object, Bucket=self.bucket, Key=key)
+
+    def url(self, key: str) -> str:
+        return f"{S3_PUBLIC_URL or PHOTO_BASE_URL}/{key}"
+
+async def iter_file(path: str) -> AsyncIterator[bytes]:
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        f.close()
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET)
+    return LocalStorage(MEDIA_ROOT)
+
+storage = create_storage()
+
+async def iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    """Read an UploadFile in chunks, enforcing MAX_PHOTO_BYTES"""
+    total = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        total += len(chunk)
+        if total > MAX_PHOTO_BYTES:
+            raise HTTPException(status_code=413, detail="Photo too large")
+        yield chunk
+
+def photo_extension(filename: Optional[str], content_type: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not ext and content_type:
+        ext = mimetypes.guess_extension(content_type) or ""
+    return ext if ext in {".jpg", ".jpeg", ".png", ".webp", ".heic", ".gif"} else ".jpg"
+
+async def store_photo(file: UploadFile) -> dict:
+    """Stream one uploaded photo to storage and describe the stored object"""
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Not an image: {file.filename}")
+    staged_path, digest, crc, size = await stage_upload(iter_upload(file))
+    return await store_content(staged_path, digest, crc, size, file.filename, file.content_type)
+
+async def stage_upload(chunks: AsyncIterator[bytes]):
+    """Spool chunks to a local staging file, hashing as they pass; returns (path, sha256, crc32, size)"""
+    await asyncio.to_thread(os.makedirs, PHOTO_STAGING_DIR, exist_ok=True)
+    path = os.path.join(PHOTO_STAGING_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    crc = 0
+    size = 0
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        async for chunk in chunks:
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+        await asyncio.to_thread(f.close)
+    except BaseException:
+        f.close()
+        await asyncio.to_thread(_remove_quietly, path)
+        raise
+    return path, digest.hexdigest(), crc, size
+
+def hash_file(path: str):
+    """(sha256, crc32) of a local file; the CRC is what ZIP archives of the photo need"""
+    digest = hashlib.sha256()
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+    return digest.hexdigest(), crc
+
+def content_key(digest: str, filename: Optional[str], content_type: Optional[str]) -> str:
+    return f"sha256/{digest[:2]}/{digest[2:4]}/{digest}{photo_extension(filename, content_type)}"
+
+async def reference_photo(digest: str, insert: Optional[dict] = None) -> Optional[dict]:
+    """Take one reference on a live stored photo and return its prior document; None when missing (created from `insert` if given)"""
+    live = {"_id": digest, "deleting": {"$ne": True}}
+    update = {"$inc": {"refcount": 1}, "$set": {"updatedAt": datetime.now(timezone.utc)}}
+    if insert:
+        update["$setOnInsert"] = insert
+    try:
+        return await photos_collection.find_one_and_update(
+            live, update, upsert=bool(insert), return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Another upload of the same bytes inserted it first; take a reference on theirs
+        previous = await photos_collection.find_one_and_update(live, update, return_document=ReturnDocument.BEFORE)
+        if previous is None:
+            raise HTTPException(status_code=503, detail="Photo is being reclaimed, retry the upload")
+        return previous
+
+async def wait_for_reclaim(digest: str):
+    """Block while the sweeper is deleting this photo's objects, so a new copy is not deleted with them"""
+    deadline = time.monotonic() + PHOTO_RECLAIM_WAIT
+    while await photos_collection.find_one({"_id": digest, "deleting": True}, {"_id": 1}):
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=503, detail="Photo is being reclaimed, retry the upload")
+        await asyncio.sleep(0.25)
+
+async def release_photos(digests: List[str]):
+    """Drop one reference per digest; sweep_orphan_photos reclaims what reaches zero"""
+    if not digests:
+        return
+    now = datetime.now(timezone.utc)
+    await photos_collection.bulk_write([
+        UpdateOne({"_id": digest}, {"$inc": {"refcount": -count}, "$set": {"updatedAt": now}})
+        for digest, count in Counter(digests).items()
+    ])
+
+async def store_content(staged_path: str, digest: str, crc: int, size: int, filename: Optional[str], content_type: Optional[str]) -> dict:
+    """Store a staged file under its content hash and take a reference on it"""
+    key = content_key(digest, filename, content_type)
+    try:
+        previous = await reference_photo(digest)
+        if previous is None:
+            await wait_for_reclaim(digest)
+            await storage.put_file(key, staged_path, content_type)
+            previous = await reference_photo(digest, {
+                "key": key, "size": size, "crc32": crc, "contentType": content_type,
+                "createdAt": datetime.now(timezone.utc),
+            })
+            if previous is not None and previous["key"] != key:
+                # A concurrent upload of the same bytes under another extension won the insert
+                await storage.delete(key)
+    finally:
+        await asyncio.to_thread(_remove_quietly, staged_path)
+    return photo_record(previous or {"_id": digest, "key": key, "size": size, "crc32": crc, "contentType": content_type}, filename)
+
+def photo_record(photo: dict, filename: Optional[str]) -> dict:
+    """The fotosArchivos entry of a client for one stored photo document"""
+    record = {
+        "key": photo["key"],
+        "sha256": photo["_id"],
+        "url": storage.url(photo["key"]),
+        "nombre": filename,
+        "size": photo["size"],
+        "contentType": photo.get("contentType"),
+        "subidaEn": datetime.now(timezone.utc).isoformat(),
+    }
+    if photo.get("crc32") is not None:
+        record["crc32"] = photo["crc32"]
+    if photo.get("derivados"):
+        record["derivados"] = photo["derivados"]
+    return record
+
+async def attach_photos(collection, client_id: str, fotografo_id: str, photos: List[dict]) -> Optional[List[dict]]:
+    """Append stored photos to a client; returns those attached, or None when the client does not exist"""
+    existing = await collection.find_one({"id": client_id}, {"_id": 0, "fotosArchivos.sha256": 1})
+    if existing is None:
+        await release_photos([p["sha256"] for p in photos])
+        return None
+    seen = {p.get("sha256") for p in existing.get("fotosArchivos") or []}
+    attached, duplicates = [], []
+    for photo in photos:
+        (duplicates if photo["sha256"] in seen else attached).append(photo)
+        seen.add(photo["sha256"])
+    await release_photos([p["sha256"] for p in duplicates])
+
+    # $push cannot append to the null that unattended clients carry
+    await collection.update_one({"id": client_id, "fotosSubidas": None}, {"$set": {"fotosSubidas": []}})
+    result = await collection.update_one(
+        {"id": client_id},
+        {
+            "$set": {"status": "atendido", "fotografoAsignado": fotografo_id},
+            "$push": {
+                "fotosSubidas": {"$each": [p["url"] for p in attached]},
+                "fotosArchivos": {"$each": attached},
+            },
+        }
+    )
+    if result.matched_count == 0:
+        await release_photos([p["sha256"] for p in attached])
+        return None
+    return attached
+
+async def upload_client_photos(collection, client_id: str, fotografo_id: str, files: List[UploadFile]) -> dict:
+    if not await collection.find_one({"id": client_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Client not found")
+    photos = []
+    try:
+        for file in files:
+            photos.append(await store_photo(file))
+    except BaseException:
+        # Give back the references a batch that failed halfway already took
+        await release_photos([p["sha256"] for p in photos])
+        raise
+    attached = await attach_photos(collection, client_id, fotografo_id, photos)
+    if attached is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    schedule_derivatives(attached)
+    return await collection.find_one({"id": client_id}, {"_id": 0})
+
+async def release_client_photos(client: dict):
+    """Drop the references a deleted client held on its stored photos"""
+    photos = client.get("fotosArchivos") or []
+    await release_photos([p["sha256"] for p in photos if p.get("sha256")])
+    # Photos stored before content addressing belong to this client alone
+    for photo in photos:
+        if not photo.get("sha256"):
+            await delete_photo_objects(photo["key"])
+
+async def delete_photo_objects(key: str):
+    await storage.delete(key)
+    for size_name in DERIVATIVE_SIZES:
+        for fmt_name in DERIVATIVE_FORMATS:
+            await storage.delete(derivative_key(key, size_name, fmt_name))
+
+async def remove_orphan_photos() -> int:
+    """Delete photos whose refcount has been zero for PHOTO_ORPHAN_GRACE"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=PHOTO_ORPHAN_GRACE)
+    removed = 0
+    query = {"refcount": {"$lte": 0}, "updatedAt": {"$lt": cutoff}}
+    async for photo in photos_collection.find(query, {"_id": 1, "updatedAt": 1}):
+        # Tombstone first, only if nothing referenced it since the query; uploads then
+        # wait for the objects to be gone instead of sharing them
+        claimed = await photos_collection.find_one_and_update(
+            {"_id": photo["_id"], "refcount": {"$lte": 0}, "updatedAt": photo["updatedAt"]},
+            {"$set": {"deleting": True}},
+        )
+        if claimed is None:
+            continue
+        await delete_photo_objects(claimed["key"])
+        await photos_collection.delete_one({"_id": photo["_id"], "deleting": True})
+        removed += 1
+    return removed
+
+async def sweep_orphan_photos():
+    while True:
+        try:
+            removed = await remove_orphan_photos()
+            if removed:
+                logger.info(f"Reclaimed {removed} unreferenced photos")
+        except Exception as e:
+            logger.error(f"Photo sweep failed: {e}")
+        await asyncio.sleep(PHOTO_SWEEP_INTERVAL)
+
+# ==================== PHOTO DERIVATIVES ====================
+
+# Long-edge pixel size of each derivative; every size is written as WebP plus a JPEG fallback
+DERIVATIVE_SIZES = {"thumb": 400, "gallery": 1280, "download": 2560}
+DERIVATIVE_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}), "jpeg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True})}
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", str(os.cpu_count() or 1)))
+derivative_pool: Optional[ProcessPoolExecutor] = None
+
+# Runs in the spawned process pool: keep it top-level and working on file paths only
+def render_derivatives(source_path: str, output_dir: str) -> List[dict]:
+    """Resize one photo into every DERIVATIVE_SIZES x DERIVATIVE_FORMATS file"""
+    rendered = []
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    for size_name, long_edge in DERIVATIVE_SIZES.items():
+        resized = image.copy()
+        # thumbnail() never upscales, so small originals keep their size
+        resized.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        for fmt_name, (pil_format, options) in DERIVATIVE_FORMATS.items():
+            path = os.path.join(output_dir, f"{size_name}.{fmt_name}")
+            resized.save(path, pil_format, **options)
+            rendered.append({"size": size_name, "format": fmt_name, "path": path, "width": resized.width, "height": resized.height})
+    return rendered
+
+async def generate_derivatives(key: str, work_dir: str) -> dict:
+    """Render and store the derivatives of one stored photo; returns the derivados map"""
+    if isinstance(storage, LocalStorage):
+        source_path = storage.path(key)
+    else:
+        source_path = os.path.join(work_dir, "source")
+        f = await asyncio.to_thread(open, source_path, "wb")
+        try:
+            async for chunk in storage.open(key):
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            f.close()
+
+    loop = asyncio.get_running_loop()
+    rendered = await loop.run_in_executor(derivative_pool, render_derivatives, source_path, work_dir)
+
+    derivados = {}
+    for item in rendered:
+        target_key = derivative_key(key, item["size"], item["format"])
+        await storage.save(target_key, iter_file(item["path"]), f"image/{item['format']}")
+        variant = derivados.setdefault(item["size"], {"width": item["width"], "height": item["height"]})
+        variant[item["format"]] = storage.url(target_key)
+    return derivados
+
+def derivative_key(key: str, size_name: str, fmt_name: str) -> str:
+    return f"derivatives/{os.path.splitext(key)[0]}/{size_name}.{fmt_name}"
+
+async def process_photo_derivatives(digest: str, key: str):
+    """Background stage after upload: record derivados on the photo and on every client entry using it"""
+    try:
+        with tempfile.TemporaryDirectory(prefix="derivatives-") as work_dir:
+            derivados = await generate_derivatives(key, work_dir)
+        await photos_collection.update_one({"_id": digest}, {"$set": {"derivados": derivados}})
+        for collection in (ambulant_clients_collection, activity_clients_collection):
+            await collection.update_many(
+                {"fotosArchivos.key": key},
+                {"$set": {"fotosArchivos.$.derivados": derivados}}
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Derivative generation failed for {key}: {e}")
+
+def schedule_derivatives(photos: List[dict]):
+    # Duplicates of an already processed photo arrive with its derivados
+    for photo in photos:
+        if not photo.get("derivados"):
+            spawn_background(process_photo_derivatives(photo["sha256"], photo["key"]))
+
+# ==================== SIGNED PHOTO URLS ====================
+
+# Photo URLs carry an HMAC over path, client id and expiry, checked without a Mongo read
+PHOTO_URL_SECRET = os.environ.get("PHOTO_URL_SECRET")
+PHOTO_URL_TTL = int(os.environ.get("PHOTO_URL_TTL_SECONDS", str(6 * 3600)))
+# Expiries are rounded up to this step so repeated lookups return identical,
+# cacheable URLs
+PHOTO_URL_EXPIRY_STEP = int(os.environ.get("PHOTO_URL_EXPIRY_STEP_SECONDS", "3600"))
+# A per-process secret breaks every issued link on restart and across workers; only for local development
+ALLOW_EPHEMERAL_PHOTO_URL_SECRET = os.environ.get("ALLOW_EPHEMERAL_PHOTO_URL_SECRET", "").lower() in ("1", "true", "yes")
+if not PHOTO_URL_SECRET:
+    if not ALLOW_EPHEMERAL_PHOTO_URL_SECRET:
+        raise RuntimeError("PHOTO_URL_SECRET is required (set ALLOW_EPHEMERAL_PHOTO_URL_SECRET=1 for local development)")
+    logger.warning("PHOTO_URL_SECRET not set; signed photo URLs will not survive a restart or work across workers")
+    PHOTO_URL_SECRET = secrets.token_urlsafe(32)
+
+def photo_signature(path: str, client_id: str, expires: int) -> str:
+    mac = hmac.new(PHOTO_URL_SECRET.encode(), f"{path}\n{client_id}\n{expires}".encode(), hashlib.sha256)
+    return base64.urlsafe_b64encode(mac.digest()[:18]).decode()
+
+def photo_url_expiry() -> int:
+    return -(-(int(time.time()) + PHOTO_URL_TTL) // PHOTO_URL_EXPIRY_STEP) * PHOTO_URL_EXPIRY_STEP
+
+def signed_query(path: str, client_id: str, expires: int) -> str:
+    return urlencode({"c": client_id, "e": expires, "s": photo_signature(path, client_id, expires)})
+
+def verify_photo_signature(request: Request, path: str):
+    params = request.query_params
+    client_id, expires, signature = params.get("c"), params.get("e"), params.get("s")
+    if not (client_id and expires and signature):
+        raise HTTPException(status_code=403, detail="Signed URL required")
+    try:
+        expires = int(expires)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    if expires < time.time():
+        raise HTTPException(status_code=403, detail="Link expired")
+    if not hmac.compare_digest(signature, photo_signature(path, client_id, expires)):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+
+def archive_path(client_id: str) -> str:
+    return f"clients/{client_id}/photos.zip"
+
+def sign_client_photos(client: dict) -> dict:
+    """Swap the client's photo URLs for signed, expiring ones and add fotosZip"""
+    client_id = client["id"]
+    expires = photo_url_expiry()
+    prefix = f"{PHOTO_BASE_URL}/"
+
+    def sign(url: str) -> str:
+        # Seeded and external URLs are not ours to sign
+        if not url or not url.startswith(prefix):
+            return url
+        return f"{url}?{signed_query(url[len(prefix):], client_id, expires)}"
+
+    if client.get("fotosSubidas"):
+        client["fotosSubidas"] = [sign(url) for url in client["fotosSubidas"]]
+    for photo in client.get("fotosArchivos") or []:
+        photo["url"] = sign(photo["url"])
+        for variant in (photo.get("derivados") or {}).values():
+            for fmt_name in DERIVATIVE_FORMATS:
+                if fmt_name in variant:
+                    variant[fmt_name] = sign(variant[fmt_name])
+    if client.get("fotosArchivos"):
+        path = archive_path(client_id)
+        client["fotosZip"] = f"{APP_URL}/api/{path}?{signed_query(path, client_id, expires)}"
+    return client
+
+# ==================== RESUMABLE UPLOAD SESSIONS ====================
+
+# tus-style sessions persisted on disk: <id>.json holds the metadata and
+# <id>.part the bytes received so far, whose size is the current offset.
+UPLOAD_SESSION_DIR = os.environ.get("UPLOAD_SESSION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+UPLOAD_GC_INTERVAL = int(os.environ.get("UPLOAD_GC_INTERVAL_SECONDS", "900"))
+upload_session_locks: dict = {}
+
+def upload_session_paths(upload_id: str):
+    # Session ids are generated by us; anything else must not reach the filesystem
+    if not upload_id.isalnum():
+        raise HTTPException(status_code=404, detail="Upload not found")
+    base = os.path.join(UPLOAD_SESSION_DIR, upload_id)
+    return f"{base}.json", f"{base}.part"
+
+def read_upload_session(upload_id: str) -> dict:
+    meta_path, part_path = upload_session_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            session = json.load(f)
+        session["offset"] = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def write_upload_session(session: dict):
+    meta_path, part_path = upload_session_paths(session["id"])
+    os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+    with open(meta_path, "w") as f:
+        json.dump({k: v for k, v in session.items() if k != "offset"}, f)
+    open(part_path, "ab").close()
+
+def remove_upload_session(upload_id: str):
+    for path in upload_session_paths(upload_id):
+        _remove_quietly(path)
+    upload_session_locks.pop(upload_id, None)
+
+async def load_upload_session(upload_id: str) -> dict:
+    try:
+        return await asyncio.to_thread(read_upload_session, upload_id)
+    except HTTPException:
+        # Never keep a lock for an id that has no session
+        upload_session_locks.pop(upload_id, None)
+        raise
+
+async def upload_session_lock(upload_id: str) -> asyncio.Lock:
+    """Per-session lock, created only once the session is known to exist"""
+    await load_upload_session(upload_id)
+    return upload_session_locks.setdefault(upload_id, asyncio.Lock())
+
+def remove_stale_upload_sessions() -> int:
+    """Delete sessions that have not received bytes for UPLOAD_SESSION_TTL"""
+    if not os.path.isdir(UPLOAD_SESSION_DIR):
+        return 0
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    removed = 0
+    for name in os.listdir(UPLOAD_SESSION_DIR):
+        upload_id, ext = os.path.splitext(name)
+        if ext != ".json":
+            continue
+        _, part_path = upload_session_paths(upload_id)
+        try:
+            last_activity = os.path.getmtime(part_path)
+        except FileNotFoundError:
+            last_activity = 0
+        if last_activity < cutoff:
+            remove_upload_session(upload_id)
+            removed += 1
+    return removed
+
+async def collect_stale_upload_sessions():
+    while True:
+        try:
+            removed = await asyncio.to_thread(remove_stale_upload_sessions)
+            if removed:
+                logger.info(f"Removed {removed} stale upload sessions")
+        except Exception as e:
+            logger.error(f"Upload session GC failed: {e}")
+        await asyncio.sleep(UPLOAD_GC_INTERVAL)
+
+# ==================== EMAIL OUTBOX ====================
+
+# Emails are queued in Mongo and sent in Resend batches by background workers, with exponential backoff
+EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", "2"))
+EMAIL_BATCH_SIZE = min(int(os.environ.get("EMAIL_BATCH_SIZE", "50")), 100)  # Resend accepts at most 100 per batch
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_BASE = float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", "5"))
+EMAIL_RETRY_MAX = float(os.environ.get("EMAIL_RETRY_MAX_SECONDS", "3600"))
+EMAIL_LEASE = int(os.environ.get("EMAIL_LEASE_SECONDS", "120"))  # A claim older than this is retaken (worker died mid-send)
+EMAIL_POLL_INTERVAL = float(os.environ.get("EMAIL_POLL_INTERVAL_SECONDS", "5"))
+outbox_wakeup = asyncio.Event()
+
+async def enqueue_email(kind: str, to: str, subject: str, html: str, ref: Optional[str] = None) -> str:
+    now = datetime.now(timezone.utc)
+    outbox_id = generate_id("EM")
+    await email_outbox_collection.insert_one({
+        "id": outbox_id,
+        "kind": kind,
+        "ref": ref,
+        "to": to,
+        "subject": subject,
+        "html": html,
+        "status": "pending",
+        "attempts": 0,
+        "nextAttemptAt": now,
+        "createdAt": now,
+    })
+    outbox_wakeup.set()
+    return outbox_id
+
+async def claim_email_batch() -> List[dict]:
+    """Atomically take up to EMAIL_BATCH_SIZE due emails for this worker"""
+    now = datetime.now(timezone.utc)
+    due = {"$or": [
+        {"status": "pending", "nextAttemptAt": {"$lte": now}},
+        {"status": "sending", "leaseExpiresAt": {"$lt": now}},
+    ]}
+    candidates = await email_outbox_collection.find(due, {"_id": 1}).sort("nextAttemptAt", ASCENDING).limit(EMAIL_BATCH_SIZE).to_list(length=None)
+    if not candidates:
+        return []
+    claim = uuid.uuid4().hex
+    # Re-applying the due filter leaves out anything another worker claimed meanwhile
+    await email_outbox_collection.update_many(
+        {"_id": {"$in": [doc["_id"] for doc in candidates]}, **due},
+        {"$set": {"status": "sending", "claim": claim, "leaseExpiresAt": now + timedelta(seconds=EMAIL_LEASE)}, "$inc": {"attempts": 1}}
+    )
+    return await email_outbox_collection.find({"claim": claim}).to_list(length=None)
+
+def email_retry_delay(attempts: int) -> float:
+    # Full jitter keeps workers from retrying a recovering provider in lockstep
+    return random.uniform(0.5, 1.0) * min(EMAIL_RETRY_BASE * 2 ** (attempts - 1), EMAIL_RETRY_MAX)
+
+def email_params(doc: dict) -> dict:
+    return {"from": SENDER_EMAIL, "to": [doc["to"]], "subject": doc["subject"], "html": doc["html"]}
+
+def permanent_email_error(error: Exception) -> bool:
+    # Resend rejects bad input with 400/422; rate limits, 5xx and network errors are worth retrying
+    return isinstance(error, resend.exceptions.ResendError) and str(error.code) in ("400", "422")
+
+async def mark_emails_sent(batch: List[dict], results: List[dict]):
+    now = datetime.now(timezone.utc)
+    await email_outbox_collection.bulk_write([
+        UpdateOne(
+            {"_id": doc["_id"], "claim": doc["claim"]},
+            {"$set": {"status": "sent", "sentAt": now, "providerId": result.get("id")}, "$unset": {"claim": "", "leaseExpiresAt": "", "lastError": ""}}
+        )
+        for doc, result in zip(batch, results + [{}] * (len(batch) - len(results)))
+    ])
+
+async def reschedule_emails(batch: List[dict], error: Exception):
+    now = datetime.now(timezone.utc)
+    permanent = permanent_email_error(error)
+    for doc in batch:
+        if permanent or doc["attempts"] >= EMAIL_MAX_ATTEMPTS:
+            update = {"status": "failed"}
+        else:
+            update = {"status": "pending", "nextAttemptAt": now + timedelta(seconds=email_retry_delay(doc["attempts"]))}
+        await email_outbox_collection.update_one(
+            {"_id": doc["_id"], "claim": doc["claim"]},
+            {"$set": {**update, "lastError": str(error)}, "$unset": {"claim": "", "leaseExpiresAt": ""}}
+        )
+
+async def deliver_email_batch(batch: List[dict]):
+    try:
+        response = await asyncio.to_thread(resend.Batch.send, [email_params(doc) for doc in batch])
+    except Exception as e:
+        logger.warning(f"Email batch of {len(batch)} failed: {e}")
+        if len(batch) > 1 and permanent_email_error(e):
+            # One bad address rejects the whole batch; send one by one so only that email fails
+            for doc in batch:
+                await deliver_email(doc)
+        else:
+            await reschedule_emails(batch, e)
+        return
+    await mark_emails_sent(batch, response.get("data") or [])
+
+async def deliver_email(doc: dict):
+    try:
+        result = await asyncio.to_thread(resend.Emails.send, email_params(doc))
+    except Exception as e:
+        logger.warning(f"Email {doc['id']} to {doc['to']} failed: {e}")
+        await reschedule_emails([doc], e)
+        return
+    await mark_emails_sent([doc], [result])
+
+async def email_outbox_worker():
+    while True:
+        try:
+            batch = await claim_email_batch()
+            if batch:
+                await deliver_email_batch(batch)
+                continue
+        except Exception as e:
+            logger.error(f"Email outbox worker failed: {e}")
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), EMAIL_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        outbox_wakeup.clear()
 
 # Password hashing
 def hash_password(password: str) -> str:
@@ -61,12 +1994,9 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return hash_password(password) == hashed
 
-# Email sending function
-async def send_activation_email(recipient_email: str, nombre: str, activation_link: str) -> dict:
-    if not RESEND_API_KEY:
-        return {"status": "skipped", "reason": "No API key configured"}
-    
-    html_content = f"""
+# Email content
+def activation_email_html(nombre: str, activation_link: str) -> str:
+    return f"""
     <!DOCTYPE html>
     <html>
     <body style="font-family: 'Segoe UI', Arial, sans-serif; background-color: #0a0a0f; color: #ffffff; margin: 0; padding: 40px 20px;">
@@ -88,17 +2018,17 @@ async def send_activation_email(recipient_email: str, nombre: str, activation_li
     </body>
     </html>
     """
-    
-    try:
-        email = await asyncio.to_thread(resend.Emails.send, {
-            "from": SENDER_EMAIL,
-            "to": [recipient_email],
-            "subject": "🎉 ¡Bienvenido a Fotos Express! - Activa tu cuenta",
-            "html": html_content
-        })
-        return {"status": "success", "email_id": email.get("id")}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+
+async def queue_activation_email(recipient_email: str, nombre: str, activation_link: str, staff_user_id: str) -> dict:
+    if not RESEND_API_KEY:
+        return {"status": "skipped", "reason": "No API key configured"}
+    outbox_id = await enqueue_email(
+        "activation", recipient_email,
+        "🎉 ¡Bienvenido a Fotos Express! - Activa tu cuenta",
+        activation_email_html(nombre, activation_link),
+        ref=staff_user_id,
+    )
+    return {"status": "queued", "outboxId": outbox_id}
 
 # Helper functions
 def generate_id(prefix: str) -> str:
@@ -107,6 +2037,45 @@ def generate_id(prefix: str) -> str:
 def generate_activation_token() -> str:
     return secrets.token_urlsafe(32)
 
+# Pagination
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", "500"))
+
+def page_limit():
+    return Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit to return every document")
+
+def count_matching(collection, query: dict):
+    # Unfiltered totals come from collection metadata instead of a scan
+    return collection.count_documents(query) if query else collection.estimated_document_count()
+
+async def fetch_page(collection, query: dict, limit: Optional[int], after: Optional[str], projection: Optional[dict] = None):
+    """Keyset pagination on _id; returns (docs, total, next_cursor), everything without `limit`"""
+    page_query = dict(query)
+    if after:
+        try:
+            page_query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    cursor = collection.find(page_query, projection).sort("_id", ASCENDING)
+    if limit:
+        # Fetch one extra row to know whether another page exists
+        cursor = cursor.limit(limit + 1)
+    docs, total = await asyncio.gather(cursor.to_list(length=None), count_matching(collection, query))
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = str(docs[-1]["_id"])
+    for doc in docs:
+        doc.pop("_id", None)
+    return docs, total, next_cursor
+
+async def find_page(collection, query: dict, response: Response, limit: Optional[int], after: Optional[str], projection: Optional[dict] = None) -> list:
+    """fetch_page for list endpoints, reporting X-Total-Count and X-Next-Cursor"""
+    docs, total, next_cursor = await fetch_page(collection, query, limit, after, projection)
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return docs
+
 # ==================== PYDANTIC MODELS ====================
 
 # Zones (Ambulant areas)
@@ -153,8 +2122,33 @@ class AmbulantClient(BaseModel):
     fotografoAsignado: Optional[str] = None
     fotosSubidas: Optional[List[str]] = None
 
-class AmbulantClientResponse(AmbulantClient):
+class PhotoVariant(BaseModel):
+    width: int
+    height: int
+    webp: str
+    jpeg: str
+
+class StoredPhoto(BaseModel):
+    key: str
+    url: str
+    nombre: Optional[str] = None
+    size: int
+    contentType: Optional[str] = None
+    subidaEn: Optional[str] = None
+    derivados: Optional[dict[str, PhotoVariant]] = None  # thumb / gallery / download, filled in by the background stage
+
+class ClientPhotos(BaseModel):
+    fotosArchivos: Optional[List[StoredPhoto]] = None
+    fotosZip: Optional[str] = None  # Signed archive URL, added on serialization
+
+    @model_serializer(mode="wrap")
+    def sign_photos(self, handler):
+        # Every response that carries a client carries signed photo URLs
+        return sign_client_photos(handler(self))
+
+class AmbulantClientResponse(AmbulantClient, ClientPhotos):
     id: str
+    telefonoE164: Optional[str] = None
     zonaNombre: Optional[str] = None
     fechaRegistro: Optional[str] = None
 
@@ -169,8 +2163,9 @@ class ActivityClient(BaseModel):
     fotografoAsignado: Optional[str] = None
     fotosSubidas: Optional[List[str]] = None
 
-class ActivityClientResponse(ActivityClient):
+class ActivityClientResponse(ActivityClient, ClientPhotos):
     id: str
+    telefonoE164: Optional[str] = None
     negocioNombre: Optional[str] = None
     actividadNombre: Optional[str] = None
     fechaRegistro: Optional[str] = None
@@ -231,213 +2226,549 @@ class PhotoUpload(BaseModel):
 class StaffAssignment(BaseModel):
     staffIds: List[str]
 
+class UploadSessionCreate(BaseModel):
+    clientType: str  # "ambulant" | "activity"
+    clientId: str
+    fotografoId: str
+    filename: str
+    size: int
+    contentType: str = "image/jpeg"
+    sha256: Optional[str] = None  # Checked against the uploaded bytes at finalize
+
+# Response-only models
+ClientResponse = Union[AmbulantClientResponse, ActivityClientResponse]
+
+class MessageResponse(BaseModel):
+    message: str
+
+class HealthResponse(BaseModel):
+    status: str
+    service: str
+
+class ClientLookupResponse(BaseModel):
+    telefonoE164: str
+    ambulantes: List[AmbulantClientResponse]
+    actividades: List[ActivityClientResponse]
+
+class UploadSessionResponse(UploadSessionCreate):
+    id: str
+    createdAt: str
+    offset: int
+
+class StaffUserResponse(BaseModel):
+    id: str
+    email: str
+    nombre: str
+    telefono: str
+    isActive: bool = True
+    createdAt: Optional[str] = None
+    activatedAt: Optional[str] = None
+    tokenExpires: Optional[str] = None
+    applicationId: Optional[str] = None
+    zonasAsignadas: Optional[List[ZoneResponse]] = None
+    actividadesAsignadas: Optional[List[ActivityResponse]] = None
+
+class StaffLoginResponse(MessageResponse):
+    user: StaffUserResponse
+
+class EmailStatus(BaseModel):
+    status: str  # "queued" | "skipped"
+    outboxId: Optional[str] = None
+    reason: Optional[str] = None
+
+class StaffApprovalResponse(MessageResponse):
+    email: str
+    nombre: str
+    activationLink: str
+    activationToken: str
+    expiresIn: str
+    emailStatus: EmailStatus
+
+class TokenValidationResponse(BaseModel):
+    valid: bool
+    email: str
+    nombre: str
+
+class StaffActivationResponse(MessageResponse):
+    email: str
+    nombre: str
+
+class EmailOutboxEntry(BaseModel):
+    id: str
+    kind: str
+    ref: Optional[str] = None
+    to: str
+    subject: str
+    status: str
+    attempts: int
+    nextAttemptAt: Optional[datetime] = None
+    leaseExpiresAt: Optional[datetime] = None
+    createdAt: datetime
+    sentAt: Optional[datetime] = None
+    providerId: Optional[str] = None
+    lastError: Optional[str] = None
+
+class IndexReport(BaseModel):
+    expected: List[str]
+    missing: List[str]
+    undeclared: List[str]
+    unused: Optional[List[str]] = None  # None when $indexStats is unavailable
+    usage: Optional[dict[str, int]] = None
+
+class WaitSummary(BaseModel):
+    count: int
+    totalSeconds: float
+    maxSeconds: float
+
+class MongoPoolStats(BaseModel):
+    maxPoolSize: int
+    minPoolSize: int
+    open: int
+    inUse: int
+    waiting: int
+    cleared: int
+    checkoutFailures: dict[str, int]
+    checkoutWait: WaitSummary
+
+class ThreadPoolStats(BaseModel):
+    maxWorkers: int
+    threads: int
+    active: int
+    queued: int
+    completed: int
+    queueWait: WaitSummary
+
+class ThreadLimiterStats(BaseModel):
+    totalTokens: int
+    borrowedTokens: int
+    tasksWaiting: int
+
+class PoolStatsResponse(BaseModel):
+    mongo: MongoPoolStats
+    motorExecutor: ThreadPoolStats
+    threadpool: ThreadPoolStats
+    starletteThreads: ThreadLimiterStats
+
+class ExplainSummary(BaseModel):
+    plan: Optional[str] = None  # COLLSCAN, IXSCAN, or the top stage otherwise
+    stages: List[str] = []
+    indexes: List[str] = []
+    docsExamined: Optional[int] = None
+    keysExamined: Optional[int] = None
+    nReturned: Optional[int] = None
+    executionTimeMillis: Optional[int] = None
+
+class SlowQueryEntry(BaseModel):
+    id: str
+    at: datetime
+    database: str
+    collection: str
+    command: str
+    durationMs: float
+    route: Optional[str] = None  # "GET /api/ambulant-clients/phone/{phone}"; None for background work
+    filter: Optional[str] = None  # JSON filter shape with values replaced by "?"
+    sort: Optional[str] = None
+    explain: Optional[ExplainSummary] = None
+    explainError: Optional[str] = None
+
+class AdminSnapshotCounts(BaseModel):
+    counts: dict[str, int]
+    cursors: dict[str, str]
+
+class AdminSnapshotResponse(AdminSnapshotCounts):
+    zones: List[ZoneResponse]
+    businesses: List[BusinessResponse]
+    activities: List[ActivityResponse]
+    ambulantClients: List[AmbulantClientResponse]
+    activityClients: List[ActivityClientResponse]
+    services: List[ServiceRequestResponse]
+    staff: List[StaffApplicationResponse]
+    staffUsers: List[StaffUserResponse]
+
 # ==================== API ENDPOINTS ====================
 
-@app.get("/api/health")
-def health_check():
+@app.get("/api/health", response_model=HealthResponse)
+async def health_check():
     return {"status": "healthy", "service": "Fotos Express API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# ==================== ADMIN: INDEXES ====================
+
+@app.get("/api/admin/indexes", response_model=dict[str, IndexReport])
+async def get_index_report():
+    """Compare INDEX_REGISTRY against the live indexes and report missing, undeclared and unused ones."""
+    report = {}
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        expected = [index.document["name"] for index in indexes]
+        existing = await collection.index_information()
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+            usage = {s["name"]: s["accesses"]["ops"] for s in stats}
+        except OperationFailure:
+            usage = None
+        report[collection_name] = {
+            "expected": expected,
+            "missing": [name for name in expected if name not in existing],
+            "undeclared": [name for name in existing if name != "_id_" and name not in expected],
+            # Usage counters reset on mongod restart, so "unused" means unused since then
+            "unused": [name for name, ops in usage.items() if ops == 0 and name != "_id_"] if usage is not None else None,
+            "usage": usage,
+        }
+    return report
+
+# ==================== ADMIN: SNAPSHOT ====================
+
+# Section name -> (collection, filter, projection) for the non-cached sections
+SNAPSHOT_COLLECTIONS = {
+    "ambulantClients": (ambulant_clients_collection, {}, None),
+    "activityClients": (activity_clients_collection, {}, None),
+    "services": (service_requests_collection, {}, None),
+    "staff": (staff_applications_collection, {}, None),
+    "staffUsers": (staff_users_collection, {"isActive": True}, {"password_hash": 0, "activationToken": 0}),
+}
+SNAPSHOT_CACHED = {"zones": zones_cache, "businesses": businesses_cache, "activities": activities_cache}
+SNAPSHOT_SECTIONS = [*SNAPSHOT_CACHED, *SNAPSHOT_COLLECTIONS]
+
+def parse_section_limits(limits: Optional[str]) -> dict:
+    """Parse `section:n,section:n` into a dict, rejecting unknown sections"""
+    parsed = {}
+    for item in filter(None, (limits or "").split(",")):
+        section, _, value = item.partition(":")
+        if section not in SNAPSHOT_SECTIONS or not value.isdigit() or int(value) < 1:
+            raise HTTPException(status_code=400, detail=f"Invalid section limit: {item}")
+        parsed[section] = min(int(value), MAX_PAGE_SIZE)
+    return parsed
+
+@app.get("/api/admin/snapshot", response_model=Union[AdminSnapshotResponse, AdminSnapshotCounts])
+async def get_admin_snapshot(
+    limit: Optional[int] = page_limit(),
+    limits: Optional[str] = Query(None, description="Per-section limits, e.g. ambulantClients:50,services:20"),
+    countsOnly: bool = False,
+):
+    """Everything the admin dashboard needs in one response"""
+    section_limits = parse_section_limits(limits)
+
+    async def load_cached(section: str):
+        cache = SNAPSHOT_CACHED[section]
+        docs = await cache.find()
+        total = len(docs)
+        if countsOnly:
+            return section, None, total, None
+        section_limit = section_limits.get(section, limit)
+        return section, docs[:section_limit] if section_limit else docs, total, None
+
+    async def load_collection(section: str):
+        collection, query, projection = SNAPSHOT_COLLECTIONS[section]
+        if countsOnly:
+            return section, None, await count_matching(collection, query), None
+        docs, total, next_cursor = await fetch_page(collection, query, section_limits.get(section, limit), None, projection)
+        return section, docs, total, next_cursor
+
+    results = await asyncio.gather(
+        *(load_cached(section) for section in SNAPSHOT_CACHED),
+        *(load_collection(section) for section in SNAPSHOT_COLLECTIONS),
+    )
+
+    snapshot = {"counts": {}, "cursors": {}}
+    for section, docs, total, next_cursor in results:
+        snapshot["counts"][section] = total
+        if next_cursor:
+            snapshot["cursors"][section] = next_cursor
+        if docs is not None:
+            snapshot[section] = docs
+    if countsOnly:
+        return snapshot
+
+    # Client sections carry denormalized names; only activities need a lookup
+    business_names = await businesses_cache.names()
+    for act in snapshot["activities"]:
+        act["negocioNombre"] = business_names.get(act.get("negocioId"), "N/A")
+    return snapshot
+
+# ==================== ADMIN: EMAIL OUTBOX ====================
+
+@app.get("/api/admin/email-outbox", response_model=List[EmailOutboxEntry])
+async def get_email_outbox(response: Response, status: Optional[str] = None, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    """Outbox entries without their bodies, oldest first; filter by status (pending, sending, sent, failed)"""
+    query = {"status": status} if status else {}
+    entries = await find_page(email_outbox_collection, query, response, limit, after, {"html": 0, "claim": 0})
+    return entries
+
+# ==================== ADMIN: POOLS ====================
+
+@app.get("/api/admin/pools", response_model=PoolStatsResponse)
+async def get_pool_stats():
+    """Occupancy and wait times of the Mongo connection pool and the thread pools in front of it"""
+    return {
+        "mongo": mongo_pool_monitor.stats(),
+        "motorExecutor": motor_executor.stats(),
+        "threadpool": default_executor.stats(),
+        "starletteThreads": starlette_thread_stats(),
+    }
+
+# ==================== ADMIN: SLOW QUERIES ====================
+
+@app.get("/api/admin/slow-queries", response_model=List[SlowQueryEntry])
+async def get_slow_queries(
+    response: Response,
+    collection: Optional[str] = None,
+    plan: Optional[str] = Query(None, description="COLLSCAN, IXSCAN, ..."),
+    route: Optional[str] = Query(None, description='e.g. "GET /api/clients/lookup"'),
+    limit: Optional[int] = page_limit(),
+    after: Optional[str] = None,
+):
+    """Commands slower than SLOW_QUERY_MS, oldest first, with their explain() summaries"""
+    query = {}
+    if collection:
+        query["collection"] = collection
+    if plan:
+        query["explain.plan"] = plan.upper()
+    if route:
+        query["route"] = route
+    return await find_page(slow_queries_collection, query, response, limit, after)
+
 # ==================== ZONES (AMBULANT AREAS) ====================
 
-@app.get("/api/zones")
-def get_zones():
-    zones = list(zones_collection.find({}, {"_id": 0}))
+@app.get("/api/zones", response_model=List[ZoneResponse])
+async def get_zones():
+    zones = await zones_cache.find()
     return zones
 
-@app.get("/api/zones/active")
-def get_active_zones():
-    zones = list(zones_collection.find({"activa": True}, {"_id": 0}))
+@app.get("/api/zones/active", response_model=List[ZoneResponse])
+async def get_active_zones(request: Request, response: Response):
+    etag = await catalog_etag("active", zones_cache)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=catalog_headers(etag))
+    response.headers.update(catalog_headers(etag))
+    zones = await zones_cache.find(lambda z: z.get("activa"))
     return zones
 
-@app.post("/api/zones")
-def create_zone(zone: Zone):
+@app.post("/api/zones", response_model=ZoneResponse)
+async def create_zone(zone: Zone):
     zone_dict = zone.model_dump()
     zone_dict["id"] = generate_id("Z")
-    zones_collection.insert_one(zone_dict)
+    await zones_collection.insert_one(zone_dict)
+    await zones_cache.mark_changed()
     zone_dict.pop("_id", None)
     return zone_dict
 
-@app.put("/api/zones/{zone_id}")
-def update_zone(zone_id: str, zone: Zone):
-    result = zones_collection.update_one({"id": zone_id}, {"$set": zone.model_dump()})
-    if result.matched_count == 0:
+@app.put("/api/zones/{zone_id}", response_model=ZoneResponse)
+async def update_zone(zone_id: str, zone: Zone):
+    previous = await zones_collection.find_one_and_update(
+        {"id": zone_id}, {"$set": zone.model_dump()}, {"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
         raise HTTPException(status_code=404, detail="Zone not found")
-    return zones_collection.find_one({"id": zone_id}, {"_id": 0})
-
-@app.put("/api/zones/{zone_id}/staff")
-def assign_staff_to_zone(zone_id: str, assignment: StaffAssignment):
-    result = zones_collection.update_one(
+    await zones_cache.mark_changed()
+    if previous.get("nombre") != zone.nombre:
+        schedule_name_fan_out(zones_cache, zone_id, zone.nombre)
+    return {**previous, **zone.model_dump()}
+
+@app.put("/api/zones/{zone_id}/staff", response_model=MessageResponse)
+async def assign_staff_to_zone(zone_id: str, assignment: StaffAssignment):
+    result = await zones_collection.update_one(
         {"id": zone_id},
         {"$set": {"fotografosAsignados": assignment.staffIds}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Zone not found")
+    await zones_cache.mark_changed()
     return {"message": "Staff assigned successfully"}
 
-@app.delete("/api/zones/{zone_id}")
-def delete_zone(zone_id: str):
-    result = zones_collection.delete_one({"id": zone_id})
+@app.delete("/api/zones/{zone_id}", response_model=MessageResponse)
+async def delete_zone(zone_id: str):
+    result = await zones_collection.delete_one({"id": zone_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Zone not found")
+    await zones_cache.mark_changed()
     return {"message": "Zone deleted"}
 
 # ==================== BUSINESSES ====================
 
-@app.get("/api/businesses")
-def get_businesses():
-    businesses = list(businesses_collection.find({}, {"_id": 0}))
+@app.get("/api/businesses", response_model=List[BusinessResponse])
+async def get_businesses():
+    businesses = await businesses_cache.find()
     return businesses
 
-@app.get("/api/businesses/active")
-def get_active_businesses():
-    businesses = list(businesses_collection.find({"activo": True}, {"_id": 0}))
+@app.get("/api/businesses/active", response_model=List[BusinessResponse])
+async def get_active_businesses(request: Request, response: Response):
+    etag = await catalog_etag("active", businesses_cache)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=catalog_headers(etag))
+    response.headers.update(catalog_headers(etag))
+    businesses = await businesses_cache.find(lambda b: b.get("activo"))
     return businesses
 
-@app.post("/api/businesses")
-def create_business(business: Business):
+@app.post("/api/businesses", response_model=BusinessResponse)
+async def create_business(business: Business):
     business_dict = business.model_dump()
     business_dict["id"] = generate_id("B")
-    businesses_collection.insert_one(business_dict)
+    await businesses_collection.insert_one(business_dict)
+    await businesses_cache.mark_changed()
     business_dict.pop("_id", None)
     return business_dict
 
-@app.put("/api/businesses/{business_id}")
-def update_business(business_id: str, business: Business):
-    result = businesses_collection.update_one({"id": business_id}, {"$set": business.model_dump()})
-    if result.matched_count == 0:
+@app.put("/api/businesses/{business_id}", response_model=BusinessResponse)
+async def update_business(business_id: str, business: Business):
+    previous = await businesses_collection.find_one_and_update(
+        {"id": business_id}, {"$set": business.model_dump()}, {"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
         raise HTTPException(status_code=404, detail="Business not found")
-    return businesses_collection.find_one({"id": business_id}, {"_id": 0})
-
-@app.delete("/api/businesses/{business_id}")
-def delete_business(business_id: str):
-    result = businesses_collection.delete_one({"id": business_id})
+    await businesses_cache.mark_changed()
+    if previous.get("nombre") != business.nombre:
+        schedule_name_fan_out(businesses_cache, business_id, business.nombre)
+    return {**previous, **business.model_dump()}
+
+@app.delete("/api/businesses/{business_id}", response_model=MessageResponse)
+async def delete_business(business_id: str):
+    result = await businesses_collection.delete_one({"id": business_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Business not found")
     # Also delete related activities
-    activities_collection.delete_many({"negocioId": business_id})
+    await activities_collection.delete_many({"negocioId": business_id})
+    await businesses_cache.mark_changed()
+    await activities_cache.mark_changed()
     return {"message": "Business and related activities deleted"}
 
 # ==================== ACTIVITIES ====================
 
-@app.get("/api/activities")
-def get_activities():
-    activities = list(activities_collection.find({}, {"_id": 0}))
+@app.get("/api/activities", response_model=List[ActivityResponse])
+async def get_activities():
+    activities = await activities_cache.find()
     # Add business name
+    business_names = await businesses_cache.names()
     for act in activities:
-        business = businesses_collection.find_one({"id": act.get("negocioId")}, {"_id": 0})
-        act["negocioNombre"] = business.get("nombre") if business else "N/A"
+        act["negocioNombre"] = business_names.get(act.get("negocioId"), "N/A")
     return activities
 
-@app.get("/api/activities/business/{business_id}")
-def get_activities_by_business(business_id: str):
-    activities = list(activities_collection.find({"negocioId": business_id, "activa": True}, {"_id": 0}))
+@app.get("/api/activities/business/{business_id}", response_model=List[ActivityResponse])
+async def get_activities_by_business(business_id: str, request: Request, response: Response):
+    etag = await catalog_etag(f"business.{business_id}", activities_cache)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=catalog_headers(etag))
+    response.headers.update(catalog_headers(etag))
+    activities = await activities_cache.find(lambda a: a.get("negocioId") == business_id and a.get("activa"))
     return activities
 
-@app.get("/api/activities/active")
-def get_active_activities():
-    activities = list(activities_collection.find({"activa": True}, {"_id": 0}))
+@app.get("/api/activities/active", response_model=List[ActivityResponse])
+async def get_active_activities(request: Request, response: Response):
+    # negocioNombre is embedded, so business renames must change the tag too
+    etag = await catalog_etag("active", activities_cache, businesses_cache)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=catalog_headers(etag))
+    response.headers.update(catalog_headers(etag))
+    activities = await activities_cache.find(lambda a: a.get("activa"))
+    business_names = await businesses_cache.names()
     for act in activities:
-        business = businesses_collection.find_one({"id": act.get("negocioId")}, {"_id": 0})
-        act["negocioNombre"] = business.get("nombre") if business else "N/A"
+        act["negocioNombre"] = business_names.get(act.get("negocioId"), "N/A")
     return activities
 
-@app.post("/api/activities")
-def create_activity(activity: Activity):
+@app.post("/api/activities", response_model=ActivityResponse)
+async def create_activity(activity: Activity):
     # Verify business exists
-    business = businesses_collection.find_one({"id": activity.negocioId})
+    business = await businesses_cache.get(activity.negocioId)
     if not business:
         raise HTTPException(status_code=404, detail="Business not found")
     
     activity_dict = activity.model_dump()
     activity_dict["id"] = generate_id("A")
-    activities_collection.insert_one(activity_dict)
+    await activities_collection.insert_one(activity_dict)
+    await activities_cache.mark_changed()
     activity_dict.pop("_id", None)
     activity_dict["negocioNombre"] = business.get("nombre")
     return activity_dict
 
-@app.put("/api/activities/{activity_id}")
-def update_activity(activity_id: str, activity: Activity):
-    result = activities_collection.update_one({"id": activity_id}, {"$set": activity.model_dump()})
-    if result.matched_count == 0:
+@app.put("/api/activities/{activity_id}", response_model=ActivityResponse)
+async def update_activity(activity_id: str, activity: Activity):
+    previous = await activities_collection.find_one_and_update(
+        {"id": activity_id}, {"$set": activity.model_dump()}, {"_id": 0}, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
         raise HTTPException(status_code=404, detail="Activity not found")
-    return activities_collection.find_one({"id": activity_id}, {"_id": 0})
-
-@app.put("/api/activities/{activity_id}/staff")
-def assign_staff_to_activity(activity_id: str, assignment: StaffAssignment):
-    result = activities_collection.update_one(
+    await activities_cache.mark_changed()
+    if previous.get("nombre") != activity.nombre:
+        schedule_name_fan_out(activities_cache, activity_id, activity.nombre)
+    return {**previous, **activity.model_dump()}
+
+@app.put("/api/activities/{activity_id}/staff", response_model=MessageResponse)
+async def assign_staff_to_activity(activity_id: str, assignment: StaffAssignment):
+    result = await activities_collection.update_one(
         {"id": activity_id},
         {"$set": {"fotografosAsignados": assignment.staffIds}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Activity not found")
+    await activities_cache.mark_changed()
     return {"message": "Staff assigned successfully"}
 
-@app.delete("/api/activities/{activity_id}")
-def delete_activity(activity_id: str):
-    result = activities_collection.delete_one({"id": activity_id})
+@app.delete("/api/activities/{activity_id}", response_model=MessageResponse)
+async def delete_activity(activity_id: str):
+    result = await activities_collection.delete_one({"id": activity_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Activity not found")
+    await activities_cache.mark_changed()
     return {"message": "Activity deleted"}
 
 # ==================== AMBULANT CLIENTS ====================
 
-@app.get("/api/ambulant-clients")
-def get_ambulant_clients():
-    clients = list(ambulant_clients_collection.find({}, {"_id": 0}))
-    for c in clients:
-        zone = zones_collection.find_one({"id": c.get("zonaId")}, {"_id": 0})
-        c["zonaNombre"] = zone.get("nombre") if zone else "N/A"
+@app.get("/api/ambulant-clients", response_model=List[AmbulantClientResponse])
+async def get_ambulant_clients(response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    clients = await find_page(ambulant_clients_collection, {}, response, limit, after)
     return clients
 
-@app.get("/api/ambulant-clients/zone/{zone_id}")
-def get_ambulant_clients_by_zone(zone_id: str):
-    clients = list(ambulant_clients_collection.find({"zonaId": zone_id}, {"_id": 0}))
-    zone = zones_collection.find_one({"id": zone_id}, {"_id": 0})
-    for c in clients:
-        c["zonaNombre"] = zone.get("nombre") if zone else "N/A"
+@app.get("/api/ambulant-clients/zone/{zone_id}", response_model=List[AmbulantClientResponse])
+async def get_ambulant_clients_by_zone(zone_id: str, response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    clients = await find_page(ambulant_clients_collection, {"zonaId": zone_id}, response, limit, after)
     return clients
 
-@app.get("/api/ambulant-clients/phone/{phone}")
-def get_ambulant_client_by_phone(phone: str):
-    client = ambulant_clients_collection.find_one({"telefono": phone}, {"_id": 0})
+@app.get("/api/ambulant-clients/phone/{phone}", response_model=AmbulantClientResponse)
+async def get_ambulant_client_by_phone(phone: str):
+    phone = normalize_phone(phone)
+    if not phone_may_exist(phone):
+        raise HTTPException(status_code=404, detail="Client not found")
+    client = await ambulant_clients_collection.find_one({"telefonoE164": phone}, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    zone = zones_collection.find_one({"id": client.get("zonaId")}, {"_id": 0})
-    client["zonaNombre"] = zone.get("nombre") if zone else "N/A"
     return client
 
-@app.get("/api/ambulant-clients/staff/{staff_id}")
-def get_ambulant_clients_for_staff(staff_id: str):
+@app.get("/api/ambulant-clients/staff/{staff_id}", response_model=List[AmbulantClientResponse])
+async def get_ambulant_clients_for_staff(staff_id: str, response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
     """Get ambulant clients for zones assigned to this staff member"""
     # Find zones where this staff is assigned
-    zones = list(zones_collection.find({"fotografosAsignados": staff_id, "activa": True}, {"_id": 0}))
+    zones = await zones_cache.find(lambda z: staff_id in z.get("fotografosAsignados", []) and z.get("activa"))
     zone_ids = [z["id"] for z in zones]
     
     # Get clients from those zones
-    clients = list(ambulant_clients_collection.find({"zonaId": {"$in": zone_ids}}, {"_id": 0}))
-    for c in clients:
-        zone = next((z for z in zones if z["id"] == c.get("zonaId")), None)
-        c["zonaNombre"] = zone.get("nombre") if zone else "N/A"
+    clients = await find_page(ambulant_clients_collection, {"zonaId": {"$in": zone_ids}}, response, limit, after)
     return clients
 
-@app.post("/api/ambulant-clients")
-def create_ambulant_client(client: AmbulantClient):
+@app.post("/api/ambulant-clients", response_model=AmbulantClientResponse)
+async def create_ambulant_client(client: AmbulantClient):
     # Verify zone exists
-    zone = zones_collection.find_one({"id": client.zonaId})
+    zone = await zones_cache.get(client.zonaId)
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
     
     client_dict = client.model_dump()
+    client_dict["telefonoE164"] = normalize_phone(client.telefono)
+    if not client_dict["telefonoE164"]:
+        raise HTTPException(status_code=400, detail="Invalid phone number")
     client_dict["id"] = generate_id("AC")
     client_dict["fechaRegistro"] = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    ambulant_clients_collection.insert_one(client_dict)
-    client_dict.pop("_id", None)
     client_dict["zonaNombre"] = zone.get("nombre")
+    await ambulant_clients_collection.insert_one(client_dict)
+    remember_phone(client_dict["telefonoE164"])
+    client_dict.pop("_id", None)
     return client_dict
 
-@app.put("/api/ambulant-clients/{client_id}/photos")
-def upload_ambulant_photos(client_id: str, upload: PhotoUpload):
-    result = ambulant_clients_collection.update_one(
+@app.put("/api/ambulant-clients/{client_id}/photos", response_model=AmbulantClientResponse)
+async def upload_ambulant_photos(client_id: str, upload: PhotoUpload):
+    result = await ambulant_clients_collection.update_one(
         {"id": client_id},
         {"$set": {
             "status": "atendido",
@@ -447,93 +2778,86 @@ def upload_ambulant_photos(client_id: str, upload: PhotoUpload):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
-    return ambulant_clients_collection.find_one({"id": client_id}, {"_id": 0})
+    return await ambulant_clients_collection.find_one({"id": client_id}, {"_id": 0})
 
-@app.delete("/api/ambulant-clients/{client_id}")
-def delete_ambulant_client(client_id: str):
-    result = ambulant_clients_collection.delete_one({"id": client_id})
-    if result.deleted_count == 0:
+@app.post("/api/ambulant-clients/{client_id}/photos/upload", response_model=AmbulantClientResponse)
+async def upload_ambulant_photo_files(client_id: str, fotografoId: str = Form(...), files: List[UploadFile] = File(...)):
+    """Multipart photo upload: files are streamed to the storage backend in chunks"""
+    return await upload_client_photos(ambulant_clients_collection, client_id, fotografoId, files)
+
+@app.delete("/api/ambulant-clients/{client_id}", response_model=MessageResponse)
+async def delete_ambulant_client(client_id: str):
+    client = await ambulant_clients_collection.find_one_and_delete({"id": client_id}, {"fotosArchivos": 1})
+    if client is None:
         raise HTTPException(status_code=404, detail="Client not found")
+    await release_client_photos(client)
     return {"message": "Client deleted"}
 
 # ==================== ACTIVITY CLIENTS ====================
 
-@app.get("/api/activity-clients")
-def get_activity_clients():
-    clients = list(activity_clients_collection.find({}, {"_id": 0}))
-    for c in clients:
-        business = businesses_collection.find_one({"id": c.get("negocioId")}, {"_id": 0})
-        activity = activities_collection.find_one({"id": c.get("actividadId")}, {"_id": 0})
-        c["negocioNombre"] = business.get("nombre") if business else "N/A"
-        c["actividadNombre"] = activity.get("nombre") if activity else "N/A"
+@app.get("/api/activity-clients", response_model=List[ActivityClientResponse])
+async def get_activity_clients(response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    clients = await find_page(activity_clients_collection, {}, response, limit, after)
     return clients
 
-@app.get("/api/activity-clients/activity/{activity_id}")
-def get_activity_clients_by_activity(activity_id: str):
-    clients = list(activity_clients_collection.find({"actividadId": activity_id}, {"_id": 0}))
-    activity = activities_collection.find_one({"id": activity_id}, {"_id": 0})
-    business = businesses_collection.find_one({"id": activity.get("negocioId")}, {"_id": 0}) if activity else None
-    for c in clients:
-        c["negocioNombre"] = business.get("nombre") if business else "N/A"
-        c["actividadNombre"] = activity.get("nombre") if activity else "N/A"
+@app.get("/api/activity-clients/activity/{activity_id}", response_model=List[ActivityClientResponse])
+async def get_activity_clients_by_activity(activity_id: str, response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    clients = await find_page(activity_clients_collection, {"actividadId": activity_id}, response, limit, after)
     return clients
 
-@app.get("/api/activity-clients/phone/{phone}")
-def get_activity_client_by_phone(phone: str, negocioId: str = Query(None), actividadId: str = Query(None)):
-    query = {"telefono": phone}
+@app.get("/api/activity-clients/phone/{phone}", response_model=ActivityClientResponse)
+async def get_activity_client_by_phone(phone: str, negocioId: str = Query(None), actividadId: str = Query(None)):
+    phone = normalize_phone(phone)
+    if not phone_may_exist(phone):
+        raise HTTPException(status_code=404, detail="Client not found")
+    query = {"telefonoE164": phone}
     if negocioId:
         query["negocioId"] = negocioId
     if actividadId:
         query["actividadId"] = actividadId
     
-    client = activity_clients_collection.find_one(query, {"_id": 0})
+    client = await activity_clients_collection.find_one(query, {"_id": 0})
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    
-    business = businesses_collection.find_one({"id": client.get("negocioId")}, {"_id": 0})
-    activity = activities_collection.find_one({"id": client.get("actividadId")}, {"_id": 0})
-    client["negocioNombre"] = business.get("nombre") if business else "N/A"
-    client["actividadNombre"] = activity.get("nombre") if activity else "N/A"
     return client
 
-@app.get("/api/activity-clients/staff/{staff_id}")
-def get_activity_clients_for_staff(staff_id: str):
+@app.get("/api/activity-clients/staff/{staff_id}", response_model=List[ActivityClientResponse])
+async def get_activity_clients_for_staff(staff_id: str, response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
     """Get activity clients for activities assigned to this staff member"""
     # Find activities where this staff is assigned
-    activities = list(activities_collection.find({"fotografosAsignados": staff_id, "activa": True}, {"_id": 0}))
+    activities = await activities_cache.find(lambda a: staff_id in a.get("fotografosAsignados", []) and a.get("activa"))
     activity_ids = [a["id"] for a in activities]
     
     # Get clients from those activities
-    clients = list(activity_clients_collection.find({"actividadId": {"$in": activity_ids}}, {"_id": 0}))
-    for c in clients:
-        activity = next((a for a in activities if a["id"] == c.get("actividadId")), None)
-        business = businesses_collection.find_one({"id": c.get("negocioId")}, {"_id": 0})
-        c["negocioNombre"] = business.get("nombre") if business else "N/A"
-        c["actividadNombre"] = activity.get("nombre") if activity else "N/A"
+    clients = await find_page(activity_clients_collection, {"actividadId": {"$in": activity_ids}}, response, limit, after)
     return clients
 
-@app.post("/api/activity-clients")
-def create_activity_client(client: ActivityClient):
+@app.post("/api/activity-clients", response_model=ActivityClientResponse)
+async def create_activity_client(client: ActivityClient):
     # Verify business and activity exist
-    business = businesses_collection.find_one({"id": client.negocioId})
+    business = await businesses_cache.get(client.negocioId)
     if not business:
         raise HTTPException(status_code=404, detail="Business not found")
-    activity = activities_collection.find_one({"id": client.actividadId})
+    activity = await activities_cache.get(client.actividadId)
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
     client_dict = client.model_dump()
+    client_dict["telefonoE164"] = normalize_phone(client.telefono)
+    if not client_dict["telefonoE164"]:
+        raise HTTPException(status_code=400, detail="Invalid phone number")
     client_dict["id"] = generate_id("EC")
     client_dict["fechaRegistro"] = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    activity_clients_collection.insert_one(client_dict)
-    client_dict.pop("_id", None)
     client_dict["negocioNombre"] = business.get("nombre")
     client_dict["actividadNombre"] = activity.get("nombre")
+    await activity_clients_collection.insert_one(client_dict)
+    remember_phone(client_dict["telefonoE164"])
+    client_dict.pop("_id", None)
     return client_dict
 
-@app.put("/api/activity-clients/{client_id}/photos")
-def upload_activity_photos(client_id: str, upload: PhotoUpload):
-    result = activity_clients_collection.update_one(
+@app.put("/api/activity-clients/{client_id}/photos", response_model=ActivityClientResponse)
+async def upload_activity_photos(client_id: str, upload: PhotoUpload):
+    result = await activity_clients_collection.update_one(
         {"id": client_id},
         {"$set": {
             "status": "atendido",
@@ -543,85 +2867,432 @@ def upload_activity_photos(client_id: str, upload: PhotoUpload):
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
-    return activity_clients_collection.find_one({"id": client_id}, {"_id": 0})
+    return await activity_clients_collection.find_one({"id": client_id}, {"_id": 0})
 
-@app.delete("/api/activity-clients/{client_id}")
-def delete_activity_client(client_id: str):
-    result = activity_clients_collection.delete_one({"id": client_id})
-    if result.deleted_count == 0:
+@app.post("/api/activity-clients/{client_id}/photos/upload", response_model=ActivityClientResponse)
+async def upload_activity_photo_files(client_id: str, fotografoId: str = Form(...), files: List[UploadFile] = File(...)):
+    """Multipart photo upload: files are streamed to the storage backend in chunks"""
+    return await upload_client_photos(activity_clients_collection, client_id, fotografoId, files)
+
+@app.delete("/api/activity-clients/{client_id}", response_model=MessageResponse)
+async def delete_activity_client(client_id: str):
+    client = await activity_clients_collection.find_one_and_delete({"id": client_id}, {"fotosArchivos": 1})
+    if client is None:
         raise HTTPException(status_code=404, detail="Client not found")
+    await release_client_photos(client)
     return {"message": "Client deleted"}
 
+# ==================== CLIENT LOOKUP ====================
+
+LOOKUP_MAX_RESULTS = int(os.environ.get("LOOKUP_MAX_RESULTS", "50"))
+
+@app.get("/api/clients/lookup", response_model=ClientLookupResponse)
+async def lookup_clients(phone: str = Query(..., min_length=1)):
+    """Every ambulant and activity registration for a phone, in one call"""
+    telefono = normalize_phone(phone)
+    if not phone_may_exist(telefono):
+        raise HTTPException(status_code=404, detail="Client not found")
+    ambulantes, actividades = await asyncio.gather(*(
+        collection.find({"telefonoE164": telefono}, {"_id": 0}).sort("_id", ASCENDING).to_list(length=LOOKUP_MAX_RESULTS)
+        for collection in (ambulant_clients_collection, activity_clients_collection)
+    ))
+    if not ambulantes and not actividades:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return {
+        "telefonoE164": telefono,
+        "ambulantes": ambulantes,
+        "actividades": actividades,
+    }
+
+# ==================== PHOTOS ====================
+
+# Objects under a content hash never change, so every cache may keep them for good
+IMMUTABLE_PHOTO_PREFIXES = ("sha256/", "derivatives/sha256/")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PHOTO_CACHE_CONTROL = os.environ.get("PHOTO_CACHE_CONTROL", "public, max-age=3600")
+# nginx internal location aliasing MEDIA_ROOT (e.g. /_media/): when set, local
+# photos are handed to the proxy with X-Accel-Redirect and sent with sendfile
+PHOTO_ACCEL_REDIRECT = os.environ.get("PHOTO_ACCEL_REDIRECT")
+
+def photo_cache_control(key: str) -> str:
+    return IMMUTABLE_CACHE_CONTROL if key.startswith(IMMUTABLE_PHOTO_PREFIXES) else PHOTO_CACHE_CONTROL
+
+def not_modified_since(request: Request, mtime: float) -> bool:
+    # If-None-Match takes precedence when both are sent
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since or "if-none-match" in request.headers:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+@app.api_route("/api/photos/{key:path}", methods=["GET", "HEAD"])
+async def get_photo(key: str, request: Request):
+    """Serve a stored photo or derivative to holders of a signed URL"""
+    verify_photo_signature(request, key)
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    cache_control = photo_cache_control(key)
+    if not isinstance(storage, LocalStorage):
+        if not await storage.exists(key):
+            raise HTTPException(status_code=404, detail="Photo not found")
+        return StreamingResponse(storage.open(key), media_type=media_type, headers={"Cache-Control": cache_control})
+
+    path = storage.path(key)
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    response = FileResponse(path, stat_result=stat_result, media_type=media_type, headers={"Cache-Control": cache_control})
+    validators = {name: response.headers[name] for name in ("etag", "last-modified", "cache-control")}
+    if etag_matches(request, validators["etag"]) or not_modified_since(request, stat_result.st_mtime):
+        return Response(status_code=304, headers=validators)
+    if PHOTO_ACCEL_REDIRECT:
+        accel_headers = {**validators, "X-Accel-Redirect": f"{PHOTO_ACCEL_REDIRECT.rstrip('/')}/{key}"}
+        return Response(media_type=media_type, headers=accel_headers)
+    return response
+
+# ==================== RESUMABLE UPLOADS ====================
+
+CLIENT_COLLECTIONS = {"ambulant": ambulant_clients_collection, "activity": activity_clients_collection}
+
+def upload_offset_headers(session: dict) -> dict:
+    return {
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["size"]),
+        "Cache-Control": "no-store",
+    }
+
+@app.post("/api/uploads", status_code=201, response_model=UploadSessionResponse)
+async def create_upload_session(data: UploadSessionCreate, response: Response):
+    """Start a resumable upload; send the bytes with PATCH and attach them with finalize"""
+    collection = CLIENT_COLLECTIONS.get(data.clientType)
+    if collection is None:
+        raise HTTPException(status_code=400, detail="clientType must be ambulant or activity")
+    if not data.contentType.startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Not an image: {data.filename}")
+    if not 0 < data.size <= MAX_PHOTO_BYTES:
+        raise HTTPException(status_code=413, detail="Photo too large")
+    if not await collection.find_one({"id": data.clientId}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Client not found")
+
+    session = {**data.model_dump(), "id": uuid.uuid4().hex, "createdAt": datetime.now(timezone.utc).isoformat()}
+    if data.sha256:
+        session["sha256"] = data.sha256.lower()
+    await asyncio.to_thread(write_upload_session, session)
+    session["offset"] = 0
+    response.headers.update(upload_offset_headers(session))
+    response.headers["Location"] = f"/api/uploads/{session['id']}"
+    return session
+
+@app.head("/api/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str):
+    session = await asyncio.to_thread(read_upload_session, upload_id)
+    return Response(status_code=200, headers=upload_offset_headers(session))
+
+@app.get("/api/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str, response: Response):
+    session = await asyncio.to_thread(read_upload_session, upload_id)
+    response.headers.update(upload_offset_headers(session))
+    return session
+
+@app.patch("/api/uploads/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request):
+    """Append the request body at Upload-Offset"""
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Upload-Offset header required")
+
+    async with await upload_session_lock(upload_id):
+        session = await load_upload_session(upload_id)
+        if offset != session["offset"]:
+            raise HTTPException(status_code=409, detail="Offset mismatch", headers=upload_offset_headers(session))
+        _, part_path = upload_session_paths(upload_id)
+        f = await asyncio.to_thread(open, part_path, "ab")
+        try:
+            async for chunk in request.stream():
+                if session["offset"] + len(chunk) > session["size"]:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds declared upload size")
+                await asyncio.to_thread(f.write, chunk)
+                session["offset"] += len(chunk)
+        finally:
+            f.close()
+    return Response(status_code=204, headers=upload_offset_headers(session))
+
+@app.post("/api/uploads/{upload_id}/finalize", response_model=ClientResponse)
+async def finalize_upload(upload_id: str):
+    """Move a complete upload into photo storage and attach it to its client"""
+    async with await upload_session_lock(upload_id):
+        session = await load_upload_session(upload_id)
+        if session["offset"] != session["size"]:
+            raise HTTPException(status_code=409, detail="Upload incomplete", headers=upload_offset_headers(session))
+        collection = CLIENT_COLLECTIONS[session["clientType"]]
+        _, part_path = upload_session_paths(upload_id)
+        digest, crc = await asyncio.to_thread(hash_file, part_path)
+        if session.get("sha256") and session["sha256"] != digest:
+            await asyncio.to_thread(remove_upload_session, upload_id)
+            raise HTTPException(status_code=422, detail="Upload does not match the declared sha256")
+        photo = await store_content(part_path, digest, crc, session["size"], session["filename"], session["contentType"])
+        await asyncio.to_thread(remove_upload_session, upload_id)
+        attached = await attach_photos(collection, session["clientId"], session["fotografoId"], [photo])
+        if attached is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+    schedule_derivatives(attached)
+    return await collection.find_one({"id": session["clientId"]}, {"_id": 0})
+
+@app.delete("/api/uploads/{upload_id}", response_model=MessageResponse)
+async def cancel_upload(upload_id: str):
+    await asyncio.to_thread(read_upload_session, upload_id)
+    await asyncio.to_thread(remove_upload_session, upload_id)
+    return {"message": "Upload cancelled"}
+
+# ==================== PHOTO ARCHIVES ====================
+
+# Photos are stored, not deflated, so the archive layout and length are known before streaming
+ZIP_PREFETCH = int(os.environ.get("ZIP_PREFETCH", "4"))  # Photos read concurrently ahead of the one being sent
+ZIP_PREFETCH_CHUNKS = int(os.environ.get("ZIP_PREFETCH_CHUNKS", "2"))  # Chunks buffered per photo being read
+ZIP_MAX_SIZE = 0xFFFFFFFF  # Offsets are 32-bit without ZIP64
+
+def requested_range(request: Request, total: int, etag: Optional[str] = None):
+    """The single byte range asked for as (start, end), end exclusive, or None for the whole body"""
+    header = request.headers.get("range")
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != etag:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), (int(last) + 1 if last else total)
+        else:
+            start, end = max(total - int(last), 0), total
+    except ValueError:
+        return None
+    end = min(end, total)
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{total}"})
+    return start, end
+
+def zip_dos_datetime(value: Optional[str]):
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        moment = datetime(1980, 1, 1)
+    if moment.year < 1980:
+        moment = datetime(1980, 1, 1)
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    dos_date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    return dos_time, dos_date
+
+def zip_entry_names(photos: List[dict]) -> List[str]:
+    """Original filenames, numbered where missing and suffixed where they collide"""
+    names, used = [], set()
+    for index, photo in enumerate(photos, 1):
+        name = os.path.basename((photo.get("nombre") or "").replace("\\", "/"))
+        if not name:
+            name = f"foto-{index}{os.path.splitext(photo['key'])[1]}"
+        stem, ext = os.path.splitext(name)
+        copy = 1
+        while name.lower() in used:
+            copy += 1
+            name = f"{stem} ({copy}){ext}"
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+def zip_layout(photos: List[dict]):
+    """Lay the archive out as segments, ("bytes", data) or ("photo", photo); returns (segments, total size)"""
+    segments, directory = [], []
+    offset = 0
+    for photo, name in zip(photos, zip_entry_names(photos)):
+        encoded = name.encode()
+        dos_time, dos_date = zip_dos_datetime(photo.get("subidaEn"))
+        crc, size = photo["crc32"], photo["size"]
+        # Flag 0x0800: UTF-8 names; method 0: stored
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 20, 0x0800, 0, dos_time, dos_date, crc, size, size, len(encoded), 0
+        ) + encoded
+        directory.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 20, 20, 0x0800, 0, dos_time, dos_date,
+            crc, size, size, len(encoded), 0, 0, 0, 0, 0o100644 << 16, offset
+        ) + encoded)
+        segments += [("bytes", header), ("photo", photo)]
+        offset += len(header) + size
+    central = b"".join(directory)
+    if offset + len(central) > ZIP_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Too many photos for one archive; download them individually")
+    end = struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(directory), len(directory), len(central), offset, 0)
+    segments.append(("bytes", central + end))
+    return segments, offset + len(central) + len(end)
+
+async def ensure_crc32(photo: dict):
+    """Photos stored before archives existed have no CRC yet: compute it once and keep it"""
+    if photo.get("crc32") is not None:
+        return
+    crc = 0
+    async for chunk in storage.open(photo["key"]):
+        crc = zlib.crc32(chunk, crc)
+    photo["crc32"] = crc
+    if photo.get("sha256"):
+        await photos_collection.update_one({"_id": photo["sha256"]}, {"$set": {"crc32": crc}})
+    for collection in CLIENT_COLLECTIONS.values():
+        await collection.update_many({"fotosArchivos.key": photo["key"]}, {"$set": {"fotosArchivos.$.crc32": crc}})
+
+async def pump_photo(key: str, start: int, end: int, queue: asyncio.Queue):
+    """Read [start, end) of an object into a bounded queue; None marks the end, an exception a failure"""
+    try:
+        received = 0
+        async for chunk in storage.open(key, start, end):
+            received += len(chunk)
+            await queue.put(chunk)
+        if received != end - start:
+            raise RuntimeError(f"{key} is shorter than recorded")
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+async def iter_zip(segments: list, start: int, end: int) -> AsyncIterator[bytes]:
+    """Yield bytes [start, end) of the archive, reading up to ZIP_PREFETCH photos ahead"""
+    pieces, position = [], 0
+    for segment in segments:
+        length = len(segment[1]) if segment[0] == "bytes" else segment[1]["size"]
+        piece_start, piece_end = max(start, position), min(end, position + length)
+        if piece_start < piece_end:
+            pieces.append((segment, piece_start - position, piece_end - position))
+        position += length
+
+    photo_pieces = [i for i, (segment, _, _) in enumerate(pieces) if segment[0] == "photo"]
+    readers = {}
+    try:
+        sent_photos = 0
+        for i, (segment, piece_start, piece_end) in enumerate(pieces):
+            if segment[0] == "bytes":
+                yield segment[1][piece_start:piece_end]
+                continue
+            for j in photo_pieces[sent_photos:sent_photos + ZIP_PREFETCH]:
+                if j not in readers:
+                    queue = asyncio.Queue(maxsize=ZIP_PREFETCH_CHUNKS)
+                    (_, photo), photo_start, photo_end = pieces[j]
+                    readers[j] = (queue, asyncio.create_task(pump_photo(photo["key"], photo_start, photo_end, queue)))
+            sent_photos += 1
+            queue, _ = readers.pop(i)
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+    finally:
+        for _, task in readers.values():
+            task.cancel()
+
+@app.get("/api/clients/{client_id}/photos.zip")
+async def download_client_photos(client_id: str, request: Request):
+    """Every stored photo of a client as one ZIP streamed from storage; Range resumes a broken download"""
+    verify_photo_signature(request, archive_path(client_id))
+    found = await asyncio.gather(*(
+        collection.find_one({"id": client_id}, {"_id": 0, "fotosArchivos": 1})
+        for collection in CLIENT_COLLECTIONS.values()
+    ))
+    client = next((doc for doc in found if doc), None)
+    if client is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    photos = client.get("fotosArchivos") or []
+    if not photos:
+        raise HTTPException(status_code=404, detail="Client has no stored photos")
+    for photo in photos:
+        await ensure_crc32(photo)
+
+    segments, total = zip_layout(photos)
+    # The central directory covers every name, size, CRC and offset
+    etag = f'"{hashlib.sha256(segments[-1][1]).hexdigest()[:32]}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="fotos-{client_id}.zip"',
+    }
+    byte_range = requested_range(request, total, etag)
+    if byte_range is None:
+        headers["Content-Length"] = str(total)
+        return StreamingResponse(iter_zip(segments, 0, total), media_type="application/zip", headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+    return StreamingResponse(iter_zip(segments, start, end), status_code=206, media_type="application/zip", headers=headers)
+
 # ==================== SERVICE REQUESTS ====================
 
-@app.get("/api/services")
-def get_services():
-    return list(service_requests_collection.find({}, {"_id": 0}))
+@app.get("/api/services", response_model=List[ServiceRequestResponse])
+async def get_services(response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    return await find_page(service_requests_collection, {}, response, limit, after)
 
-@app.post("/api/services")
-def create_service(service: ServiceRequest):
+@app.post("/api/services", response_model=ServiceRequestResponse)
+async def create_service(service: ServiceRequest):
     service_dict = service.model_dump()
     service_dict["id"] = generate_id("SR")
-    service_requests_collection.insert_one(service_dict)
+    await service_requests_collection.insert_one(service_dict)
     service_dict.pop("_id", None)
     return service_dict
 
-@app.delete("/api/services/{service_id}")
-def delete_service(service_id: str):
-    result = service_requests_collection.delete_one({"id": service_id})
+@app.delete("/api/services/{service_id}", response_model=MessageResponse)
+async def delete_service(service_id: str):
+    result = await service_requests_collection.delete_one({"id": service_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Service not found")
     return {"message": "Service deleted"}
 
 # ==================== STAFF APPLICATIONS ====================
 
-@app.get("/api/staff")
-def get_staff_applications():
-    return list(staff_applications_collection.find({}, {"_id": 0}))
+@app.get("/api/staff", response_model=List[StaffApplicationResponse])
+async def get_staff_applications(response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    return await find_page(staff_applications_collection, {}, response, limit, after)
 
-@app.post("/api/staff")
-def create_staff_application(staff: StaffApplication):
+@app.post("/api/staff", response_model=StaffApplicationResponse)
+async def create_staff_application(staff: StaffApplication):
     staff_dict = staff.model_dump()
     staff_dict["id"] = generate_id("P")
-    staff_applications_collection.insert_one(staff_dict)
+    await staff_applications_collection.insert_one(staff_dict)
     staff_dict.pop("_id", None)
     return staff_dict
 
-@app.delete("/api/staff/{staff_id}")
-def delete_staff_application(staff_id: str):
-    result = staff_applications_collection.delete_one({"id": staff_id})
+@app.delete("/api/staff/{staff_id}", response_model=MessageResponse)
+async def delete_staff_application(staff_id: str):
+    result = await staff_applications_collection.delete_one({"id": staff_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Application not found")
     return {"message": "Application deleted"}
 
 # ==================== STAFF USERS ====================
 
-@app.get("/api/staff/users")
-def get_staff_users():
-    users = list(staff_users_collection.find({"isActive": True}, {"_id": 0, "password_hash": 0, "activationToken": 0}))
+@app.get("/api/staff/users", response_model=List[StaffUserResponse])
+async def get_staff_users(response: Response, limit: Optional[int] = page_limit(), after: Optional[str] = None):
+    users = await find_page(staff_users_collection, {"isActive": True}, response, limit, after, {"password_hash": 0, "activationToken": 0})
     return users
 
-@app.get("/api/staff/user/{email}")
-def get_staff_user(email: str):
-    user = staff_users_collection.find_one({"email": email}, {"_id": 0, "password_hash": 0, "activationToken": 0})
+@app.get("/api/staff/user/{email}", response_model=StaffUserResponse)
+async def get_staff_user(email: str):
+    user = await staff_users_collection.find_one({"email": email}, {"_id": 0, "password_hash": 0, "activationToken": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get assigned zones and activities
-    zones = list(zones_collection.find({"fotografosAsignados": user["id"], "activa": True}, {"_id": 0}))
-    activities = list(activities_collection.find({"fotografosAsignados": user["id"], "activa": True}, {"_id": 0}))
+    zones = await zones_cache.find(lambda z: user["id"] in z.get("fotografosAsignados", []) and z.get("activa"))
+    activities = await activities_cache.find(lambda a: user["id"] in a.get("fotografosAsignados", []) and a.get("activa"))
     
     user["zonasAsignadas"] = zones
     user["actividadesAsignadas"] = activities
     return user
 
-@app.post("/api/staff/approve/{staff_id}")
+@app.post("/api/staff/approve/{staff_id}", response_model=StaffApprovalResponse)
 async def approve_staff_and_create_account(staff_id: str):
-    application = staff_applications_collection.find_one({"id": staff_id}, {"_id": 0})
+    application = await staff_applications_collection.find_one({"id": staff_id}, {"_id": 0})
     if not application:
         raise HTTPException(status_code=404, detail="Application not found")
     
-    existing_user = staff_users_collection.find_one({"email": application["email"]})
+    existing_user = await staff_users_collection.find_one({"email": application["email"]})
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists")
     
@@ -640,12 +3311,12 @@ async def approve_staff_and_create_account(staff_id: str):
         "createdAt": datetime.now(timezone.utc).isoformat(),
         "applicationId": staff_id
     }
-    staff_users_collection.insert_one(staff_user)
+    await staff_users_collection.insert_one(staff_user)
     
-    staff_applications_collection.update_one({"id": staff_id}, {"$set": {"status": "aprobado"}})
+    await staff_applications_collection.update_one({"id": staff_id}, {"$set": {"status": "aprobado"}})
     
     activation_link = f"{APP_URL}/activar-cuenta?token={activation_token}"
-    email_result = await send_activation_email(application["email"], application["nombre"], activation_link)
+    email_result = await queue_activation_email(application["email"], application["nombre"], activation_link, staff_user["id"])
     
     return {
         "message": "Staff approved",
@@ -657,9 +3328,9 @@ async def approve_staff_and_create_account(staff_id: str):
         "emailStatus": email_result
     }
 
-@app.get("/api/staff/validate-token")
-def validate_activation_token(token: str = Query(...)):
-    user = staff_users_collection.find_one({"activationToken": token}, {"_id": 0})
+@app.get("/api/staff/validate-token", response_model=TokenValidationResponse)
+async def validate_activation_token(token: str = Query(...)):
+    user = await staff_users_collection.find_one({"activationToken": token}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="Invalid token")
     
@@ -672,9 +3343,9 @@ def validate_activation_token(token: str = Query(...)):
     
     return {"valid": True, "email": user["email"], "nombre": user["nombre"]}
 
-@app.post("/api/staff/activate")
-def activate_staff_account(activation: StaffActivation):
-    user = staff_users_collection.find_one({"activationToken": activation.token}, {"_id": 0})
+@app.post("/api/staff/activate", response_model=StaffActivationResponse)
+async def activate_staff_account(activation: StaffActivation):
+    user = await staff_users_collection.find_one({"activationToken": activation.token}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="Invalid token")
     
@@ -688,7 +3359,7 @@ def activate_staff_account(activation: StaffActivation):
     if len(activation.password) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
     
-    staff_users_collection.update_one(
+    await staff_users_collection.update_one(
         {"activationToken": activation.token},
         {"$set": {
             "password_hash": hash_password(activation.password),
@@ -700,9 +3371,9 @@ def activate_staff_account(activation: StaffActivation):
     
     return {"message": "Account activated", "email": user["email"], "nombre": user["nombre"]}
 
-@app.post("/api/staff/login")
-def staff_login(login: StaffLogin):
-    user = staff_users_collection.find_one({"email": login.email}, {"_id": 0})
+@app.post("/api/staff/login", response_model=StaffLoginResponse)
+async def staff_login(login: StaffLogin):
+    user = await staff_users_collection.find_one({"email": login.email}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -713,8 +3384,8 @@ def staff_login(login: StaffLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Get assigned zones and activities
-    zones = list(zones_collection.find({"fotografosAsignados": user["id"], "activa": True}, {"_id": 0}))
-    activities = list(activities_collection.find({"fotografosAsignados": user["id"], "activa": True}, {"_id": 0}))
+    zones = await zones_cache.find(lambda z: user["id"] in z.get("fotografosAsignados", []) and z.get("activa"))
+    activities = await activities_cache.find(lambda a: user["id"] in a.get("fotografosAsignados", []) and a.get("activa"))
     
     return {
         "message": "Login successful",
@@ -728,9 +3399,9 @@ def staff_login(login: StaffLogin):
         }
     }
 
-@app.post("/api/staff/change-password")
-def change_staff_password(data: StaffPasswordChange):
-    user = staff_users_collection.find_one({"email": data.email}, {"_id": 0})
+@app.post("/api/staff/change-password", response_model=MessageResponse)
+async def change_staff_password(data: StaffPasswordChange):
+    user = await staff_users_collection.find_one({"email": data.email}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -743,77 +3414,118 @@ def change_staff_password(data: StaffPasswordChange):
     if len(data.newPassword) < 8:
         raise HTTPException(status_code=400, detail="Password must be at least 8 characters")
     
-    staff_users_collection.update_one(
+    await staff_users_collection.update_one(
         {"email": data.email},
         {"$set": {"password_hash": hash_password(data.newPassword)}}
     )
     
     return {"message": "Password changed"}
 
+# ==================== EXPORT ====================
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_COLLECTIONS = {
+    "ambulant-clients": ambulant_clients_collection,
+    "activity-clients": activity_clients_collection,
+    "services": service_requests_collection,
+}
+
+@app.get("/api/export/{collection_name}")
+async def export_collection(collection_name: str):
+    """Stream a whole collection as NDJSON, one document per line"""
+    collection = EXPORT_COLLECTIONS.get(collection_name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail="Export not available")
+
+    signed = collection_name in ("ambulant-clients", "activity-clients")
+
+    async def rows():
+        cursor = collection.find({}, {"_id": 0}).sort("_id", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+        lines = []
+        async for doc in cursor:
+            lines.append(orjson.dumps(sign_client_photos(doc) if signed else doc, default=str))
+            if len(lines) >= EXPORT_BATCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(
+        rows(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{collection_name}.ndjson"'}
+    )
+
 # ==================== SEED DATA ====================
 
-@app.post("/api/seed")
-def seed_data():
+@app.post("/api/seed", response_model=MessageResponse)
+async def seed_data():
     # Clear all collections
-    zones_collection.delete_many({})
-    businesses_collection.delete_many({})
-    activities_collection.delete_many({})
-    ambulant_clients_collection.delete_many({})
-    activity_clients_collection.delete_many({})
-    service_requests_collection.delete_many({})
-    staff_applications_collection.delete_many({})
-    staff_users_collection.delete_many({})
+    await zones_collection.delete_many({})
+    await businesses_collection.delete_many({})
+    await activities_collection.delete_many({})
+    # Give back the photo references the old clients held so the sweeper reclaims them
+    for collection in CLIENT_COLLECTIONS.values():
+        async for client in collection.find({"fotosArchivos.0": {"$exists": True}}, {"_id": 0, "fotosArchivos": 1}):
+            await release_client_photos(client)
+        await collection.delete_many({})
+    await service_requests_collection.delete_many({})
+    await staff_applications_collection.delete_many({})
+    await staff_users_collection.delete_many({})
     
     # Create zones
-    zones_collection.insert_many([
+    await zones_collection.insert_many([
         {"id": "Z01", "nombre": "Bahía Urbana", "descripcion": "Área de Bahía Urbana, San Juan", "activa": True, "fotografosAsignados": []},
         {"id": "Z02", "nombre": "Condado", "descripcion": "Zona turística del Condado", "activa": True, "fotografosAsignados": []},
         {"id": "Z03", "nombre": "Viejo San Juan", "descripcion": "Calles del Viejo San Juan", "activa": True, "fotografosAsignados": []}
     ])
     
     # Create businesses
-    businesses_collection.insert_many([
+    await businesses_collection.insert_many([
         {"id": "B01", "nombre": "Club La Terraza", "direccion": "Calle Luna 123", "telefono": "787-111-1111", "activo": True},
         {"id": "B02", "nombre": "Hotel Caribe Hilton", "direccion": "Av. Los Gobernadores", "telefono": "787-222-2222", "activo": True}
     ])
     
     # Create activities
-    activities_collection.insert_many([
+    await activities_collection.insert_many([
         {"id": "A01", "nombre": "Fiesta de Año Nuevo 2026", "negocioId": "B01", "descripcion": "Evento de fin de año", "activa": True, "fotografosAsignados": []},
         {"id": "A02", "nombre": "Boda Rodriguez-Martinez", "negocioId": "B02", "descripcion": "Boda en salón principal", "activa": True, "fotografosAsignados": []},
         {"id": "A03", "nombre": "Quinceañero Valentina", "negocioId": "B01", "descripcion": "Celebración de 15 años", "activa": True, "fotografosAsignados": []}
     ])
     
     # Create ambulant clients
-    ambulant_clients_collection.insert_many([
+    await ambulant_clients_collection.insert_many([
         {
-            "id": "AC01", "nombre": "Carlos Rivera", "telefono": "7871234567", "instagram": "@carlos.riv",
+            "id": "AC01", "nombre": "Carlos Rivera", "telefono": "7871234567", "telefonoE164": "+17871234567", "instagram": "@carlos.riv",
             "aceptaPublicidad": True, "fotoReferencia": "https://picsum.photos/id/1/400/400",
-            "zonaId": "Z01", "status": "atendido", "fotografoAsignado": "SU001",
+            "zonaId": "Z01", "zonaNombre": "Bahía Urbana", "status": "atendido", "fotografoAsignado": "SU001",
             "fotosSubidas": ["https://picsum.photos/id/10/800/1000", "https://picsum.photos/id/11/800/1000"],
             "fechaRegistro": "2026-02-15"
         },
         {
-            "id": "AC02", "nombre": "Maria Santos", "telefono": "7879876543", "instagram": "@maria.s",
+            "id": "AC02", "nombre": "Maria Santos", "telefono": "7879876543", "telefonoE164": "+17879876543", "instagram": "@maria.s",
             "aceptaPublicidad": False, "fotoReferencia": "https://picsum.photos/id/2/400/400",
-            "zonaId": "Z01", "status": "esperando_fotos", "fotografoAsignado": None,
+            "zonaId": "Z01", "zonaNombre": "Bahía Urbana", "status": "esperando_fotos", "fotografoAsignado": None,
             "fotosSubidas": None, "fechaRegistro": "2026-02-16"
         }
     ])
     
     # Create activity clients
-    activity_clients_collection.insert_many([
+    await activity_clients_collection.insert_many([
         {
-            "id": "EC01", "nombre": "Ana Lopez", "telefono": "7875551234",
+            "id": "EC01", "nombre": "Ana Lopez", "telefono": "7875551234", "telefonoE164": "+17875551234",
             "negocioId": "B01", "actividadId": "A01",
+            "negocioNombre": "Club La Terraza", "actividadNombre": "Fiesta de Año Nuevo 2026",
             "fotoReferencia": "https://picsum.photos/id/3/400/400",
             "status": "atendido", "fotografoAsignado": "SU001",
             "fotosSubidas": ["https://picsum.photos/id/20/800/1000", "https://picsum.photos/id/21/800/1000"],
             "fechaRegistro": "2026-02-14"
         },
         {
-            "id": "EC02", "nombre": "Pedro Gonzalez", "telefono": "7875559876",
+            "id": "EC02", "nombre": "Pedro Gonzalez", "telefono": "7875559876", "telefonoE164": "+17875559876",
             "negocioId": "B02", "actividadId": "A02",
+            "negocioNombre": "Hotel Caribe Hilton", "actividadNombre": "Boda Rodriguez-Martinez",
             "fotoReferencia": "https://picsum.photos/id/4/400/400",
             "status": "esperando_fotos", "fotografoAsignado": None,
             "fotosSubidas": None, "fechaRegistro": "2026-02-16"
@@ -821,7 +3533,7 @@ def seed_data():
     ])
     
     # Create service request
-    service_requests_collection.insert_one({
+    await service_requests_collection.insert_one({
         "id": "SR01", "tipo": "boda",
         "detalles": {"locacion": "exterior", "descripcion": "Boda en la playa", "fechaEvento": "2026-05-20", "horas": 6, "personas": 100},
         "contacto": {"nombre": "Valeria Martinez", "telefono": "787-111-2222", "email": "valeria@email.com"},
@@ -829,14 +3541,14 @@ def seed_data():
     })
     
     # Create staff application
-    staff_applications_collection.insert_one({
+    await staff_applications_collection.insert_one({
         "id": "P01", "nombre": "Javier Rodriguez", "email": "javier@cam.pr",
         "telefono": "787-999-8888", "experiencia": "5 años en eventos",
         "equipo": "Sony A7IV", "especialidades": ["Evento"], "fotosReferencia": [], "status": "pendiente"
     })
     
     # Create staff users (demo + internal test account)
-    staff_users_collection.insert_many([
+    await staff_users_collection.insert_many([
         {
             "id": "SU001", "email": "staff@fotosexpress.com", "nombre": "Staff Demo",
             "telefono": "787-000-0000", "password_hash": hash_password("Fotosexpress@"),
@@ -852,8 +3564,11 @@ def seed_data():
     ])
     
     # Assign SU002 to zones and activities for testing
-    zones_collection.update_one({"id": "Z01"}, {"$set": {"fotografosAsignados": ["SU002"]}})
-    activities_collection.update_one({"id": "A01"}, {"$set": {"fotografosAsignados": ["SU002"]}})
+    await zones_collection.update_one({"id": "Z01"}, {"$set": {"fotografosAsignados": ["SU002"]}})
+    await activities_collection.update_one({"id": "A01"}, {"$set": {"fotografosAsignados": ["SU002"]}})
+    for cache in REFERENCE_CACHES.values():
+        await cache.mark_changed()
+    await build_phone_filter()
     
     return {"message": "Data seeded successfully"}
 
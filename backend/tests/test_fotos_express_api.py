@@ -12,6 +12,15 @@ Test all CRUD operations for:
 import pytest
 import requests
 import os
+import json
+import hashlib
+import io
+import zipfile
+import time
+import sys
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://photo-portal-13.preview.emergentagent.com')
 
@@ -473,6 +482,761 @@ class TestStaffApplicationsAPI:
         print(f"✓ POST /api/staff created application with id: {data['id']}")
 
 
+class TestPagination:
+    """Keyset pagination on list endpoints"""
+    
+    def test_unpaginated_default_returns_everything(self):
+        response = requests.get(f"{BASE_URL}/api/ambulant-clients")
+        assert response.status_code == 200
+        clients = response.json()
+        assert int(response.headers["X-Total-Count"]) == len(clients)
+        assert "X-Next-Cursor" not in response.headers
+        print(f"✓ GET /api/ambulant-clients without limit returned all {len(clients)} clients")
+    
+    def test_walk_pages_with_cursor(self):
+        everything = requests.get(f"{BASE_URL}/api/ambulant-clients").json()
+        seen = []
+        after = None
+        while True:
+            params = {"limit": 1}
+            if after:
+                params["after"] = after
+            response = requests.get(f"{BASE_URL}/api/ambulant-clients", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 1
+            seen.extend(c["id"] for c in page)
+            after = response.headers.get("X-Next-Cursor")
+            if not after:
+                break
+        assert seen == [c["id"] for c in everything]
+        print(f"✓ Walked {len(seen)} ambulant clients one page at a time")
+    
+    def test_invalid_cursor(self):
+        response = requests.get(f"{BASE_URL}/api/services", params={"limit": 5, "after": "not-a-cursor"})
+        assert response.status_code == 400
+        print("✓ Invalid cursor rejected with 400")
+
+
+class TestExport:
+    """Streaming NDJSON export"""
+    
+    def test_export_ambulant_clients(self):
+        response = requests.get(f"{BASE_URL}/api/export/ambulant-clients")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines() if line]
+        total = int(requests.get(f"{BASE_URL}/api/ambulant-clients", params={"limit": 1}).headers["X-Total-Count"])
+        assert len(rows) == total
+        print(f"✓ GET /api/export/ambulant-clients streamed {len(rows)} rows")
+    
+    def test_export_unknown_collection(self):
+        response = requests.get(f"{BASE_URL}/api/export/staff_users")
+        assert response.status_code == 404
+        print("✓ Export of non-exportable collection rejected")
+
+
+class TestCatalogETags:
+    """ETag / If-None-Match on catalog endpoints"""
+    
+    @pytest.mark.parametrize("path", ["/api/zones/active", "/api/businesses/active", "/api/activities/active"])
+    def test_revalidation_returns_304(self, path):
+        response = requests.get(f"{BASE_URL}{path}")
+        assert response.status_code == 200
+        etag = response.headers.get("ETag")
+        assert etag
+        assert "max-age" in response.headers.get("Cache-Control", "")
+        revalidated = requests.get(f"{BASE_URL}{path}", headers={"If-None-Match": etag})
+        assert revalidated.status_code == 304
+        assert revalidated.content == b""
+        print(f"✓ GET {path} revalidated with 304")
+    
+    def test_etag_changes_after_write(self):
+        etag = requests.get(f"{BASE_URL}/api/zones/active").headers["ETag"]
+        create_res = requests.post(f"{BASE_URL}/api/zones", json={"nombre": "TEST_Zona_ETag", "activa": True})
+        assert create_res.status_code == 200
+        response = requests.get(f"{BASE_URL}/api/zones/active", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        requests.delete(f"{BASE_URL}/api/zones/{create_res.json()['id']}")
+        print("✓ Zone ETag changed after create")
+
+
+class TestAdminSnapshot:
+    """Aggregated admin dashboard snapshot"""
+    
+    SECTIONS = ["zones", "businesses", "activities", "ambulantClients", "activityClients", "services", "staff", "staffUsers"]
+    
+    def test_full_snapshot(self):
+        response = requests.get(f"{BASE_URL}/api/admin/snapshot")
+        assert response.status_code == 200
+        data = response.json()
+        for section in self.SECTIONS:
+            assert isinstance(data[section], list)
+            assert data["counts"][section] == len(data[section])
+        for client in data["activityClients"]:
+            assert "negocioNombre" in client and "actividadNombre" in client
+        for user in data["staffUsers"]:
+            assert "password_hash" not in user
+        print(f"✓ GET /api/admin/snapshot returned counts {data['counts']}")
+    
+    def test_counts_only(self):
+        response = requests.get(f"{BASE_URL}/api/admin/snapshot", params={"countsOnly": "true"})
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data["counts"]) == set(self.SECTIONS)
+        assert "ambulantClients" not in data
+        print("✓ countsOnly snapshot returned only counts")
+    
+    def test_section_limits(self):
+        response = requests.get(f"{BASE_URL}/api/admin/snapshot", params={"limit": 1, "limits": "services:2"})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["ambulantClients"]) <= 1
+        assert len(data["services"]) <= 2
+        bad = requests.get(f"{BASE_URL}/api/admin/snapshot", params={"limits": "unknown:3"})
+        assert bad.status_code == 400
+        print("✓ Snapshot section limits applied")
+
+
+class TestDenormalizedNames:
+    """Client documents carry parent names, updated on rename"""
+    
+    def test_zone_rename_fans_out_to_clients(self):
+        zone = requests.post(f"{BASE_URL}/api/zones", json={"nombre": "TEST_Zona_Original", "activa": True}).json()
+        client = requests.post(f"{BASE_URL}/api/ambulant-clients", json={
+            "nombre": "TEST_Cliente_Renombre", "telefono": "7870000111", "zonaId": zone["id"]
+        }).json()
+        assert client["zonaNombre"] == "TEST_Zona_Original"
+        
+        update_res = requests.put(f"{BASE_URL}/api/zones/{zone['id']}", json={"nombre": "TEST_Zona_Renombrada", "activa": True})
+        assert update_res.status_code == 200
+        assert update_res.json()["nombre"] == "TEST_Zona_Renombrada"
+        
+        # The fan-out runs in the background
+        for _ in range(20):
+            clients = requests.get(f"{BASE_URL}/api/ambulant-clients/zone/{zone['id']}").json()
+            if clients and clients[0]["zonaNombre"] == "TEST_Zona_Renombrada":
+                break
+            time.sleep(0.25)
+        assert clients[0]["zonaNombre"] == "TEST_Zona_Renombrada"
+        
+        requests.delete(f"{BASE_URL}/api/ambulant-clients/{client['id']}")
+        requests.delete(f"{BASE_URL}/api/zones/{zone['id']}")
+        print("✓ Zone rename propagated to its clients")
+
+
+class TestPhotoUpload:
+    """Multipart photo upload to the storage backend"""
+    
+    def test_upload_and_fetch_photo(self):
+        zones = requests.get(f"{BASE_URL}/api/zones/active").json()
+        if not zones:
+            pytest.skip("No active zones available")
+        client = requests.post(f"{BASE_URL}/api/ambulant-clients", json={
+            "nombre": "TEST_Cliente_Upload", "telefono": "7870000222", "zonaId": zones[0]["id"]
+        }).json()
+        
+        photo_bytes = b"\xff\xd8\xff\xe0" + os.urandom(256 * 1024)
+        response = requests.post(
+            f"{BASE_URL}/api/ambulant-clients/{client['id']}/photos/upload",
+            data={"fotografoId": "SU001"},
+            files=[("files", ("foto.jpg", photo_bytes, "image/jpeg"))]
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "atendido"
+        assert len(data["fotosSubidas"]) == 1
+        assert data["fotosArchivos"][0]["size"] == len(photo_bytes)
+        
+        # Photos are served from the signed URLs the phone lookup hands out
+        unsigned = requests.get(f"{BASE_URL}/api/photos/{data['fotosArchivos'][0]['key']}")
+        assert unsigned.status_code == 403
+        lookup = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7870000222").json()
+        photo = requests.get(lookup["fotosArchivos"][0]["url"])
+        assert photo.status_code == 200
+        assert photo.content == photo_bytes
+        print(f"✓ Uploaded and fetched photo for {client['id']}")
+    
+    def test_upload_rejects_non_images(self):
+        clients = requests.get(f"{BASE_URL}/api/ambulant-clients").json()
+        if not clients:
+            pytest.skip("No ambulant clients available")
+        response = requests.post(
+            f"{BASE_URL}/api/ambulant-clients/{clients[0]['id']}/photos/upload",
+            data={"fotografoId": "SU001"},
+            files=[("files", ("notes.txt", b"hola", "text/plain"))]
+        )
+        assert response.status_code == 415
+        print("✓ Non-image upload rejected")
+
+
+class TestPhotoDerivatives:
+    """Background thumbnail / gallery / download derivatives"""
+    
+    def test_derivatives_generated_after_upload(self):
+        from PIL import Image
+        import io
+        
+        zones = requests.get(f"{BASE_URL}/api/zones/active").json()
+        if not zones:
+            pytest.skip("No active zones available")
+        client = requests.post(f"{BASE_URL}/api/ambulant-clients", json={
+            "nombre": "TEST_Cliente_Derivados", "telefono": "7870000333", "zonaId": zones[0]["id"]
+        }).json()
+        buffer = io.BytesIO()
+        Image.new("RGB", (3000, 2000), (30, 120, 200)).save(buffer, "JPEG")
+        upload = requests.post(
+            f"{BASE_URL}/api/ambulant-clients/{client['id']}/photos/upload",
+            data={"fotografoId": "SU001"},
+            files=[("files", ("grande.jpg", buffer.getvalue(), "image/jpeg"))]
+        )
+        assert upload.status_code == 200
+        
+        derivados = None
+        for _ in range(40):
+            photo = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7870000333").json()["fotosArchivos"][0]
+            derivados = photo.get("derivados")
+            if derivados:
+                break
+            time.sleep(0.25)
+        assert derivados is not None
+        assert set(derivados) == {"thumb", "gallery", "download"}
+        assert max(derivados["thumb"]["width"], derivados["thumb"]["height"]) == 400
+        thumb = requests.get(derivados["thumb"]["webp"])
+        assert thumb.status_code == 200
+        assert thumb.content[8:12] == b"WEBP"
+        print("✓ Derivatives generated for uploaded photo")
+
+
+class TestResumableUploads:
+    """tus-style resumable upload sessions"""
+    
+    def test_resume_after_partial_upload(self):
+        clients = requests.get(f"{BASE_URL}/api/ambulant-clients").json()
+        if not clients:
+            pytest.skip("No ambulant clients available")
+        client_id = clients[0]["id"]
+        photo_bytes = b"\xff\xd8\xff\xe0" + os.urandom(512 * 1024)
+        
+        create_res = requests.post(f"{BASE_URL}/api/uploads", json={
+            "clientType": "ambulant", "clientId": client_id, "fotografoId": "SU001",
+            "filename": "resumable.jpg", "size": len(photo_bytes), "contentType": "image/jpeg"
+        })
+        assert create_res.status_code == 201
+        upload_id = create_res.json()["id"]
+        
+        half = len(photo_bytes) // 2
+        first = requests.patch(f"{BASE_URL}/api/uploads/{upload_id}", data=photo_bytes[:half], headers={"Upload-Offset": "0"})
+        assert first.status_code == 204
+        
+        head = requests.head(f"{BASE_URL}/api/uploads/{upload_id}")
+        assert int(head.headers["Upload-Offset"]) == half
+        
+        stale = requests.patch(f"{BASE_URL}/api/uploads/{upload_id}", data=photo_bytes[half:], headers={"Upload-Offset": "0"})
+        assert stale.status_code == 409
+        assert requests.post(f"{BASE_URL}/api/uploads/{upload_id}/finalize").status_code == 409
+        
+        rest = requests.patch(f"{BASE_URL}/api/uploads/{upload_id}", data=photo_bytes[half:], headers={"Upload-Offset": str(half)})
+        assert rest.status_code == 204
+        assert int(rest.headers["Upload-Offset"]) == len(photo_bytes)
+        
+        finalize = requests.post(f"{BASE_URL}/api/uploads/{upload_id}/finalize")
+        assert finalize.status_code == 200
+        assert finalize.json()["fotosArchivos"][-1]["size"] == len(photo_bytes)
+        assert requests.head(f"{BASE_URL}/api/uploads/{upload_id}").status_code == 404
+        print(f"✓ Resumable upload finalized for {client_id}")
+
+
+class TestPhotoDeduplication:
+    """Content-addressed photo storage"""
+    
+    def test_duplicate_upload_reuses_stored_object(self):
+        clients = requests.get(f"{BASE_URL}/api/ambulant-clients").json()
+        if len(clients) < 2:
+            pytest.skip("Need two ambulant clients")
+        photo_bytes = b"\xff\xd8\xff\xe0" + os.urandom(64 * 1024)
+        sha256 = hashlib.sha256(photo_bytes).hexdigest()
+        
+        first = requests.post(
+            f"{BASE_URL}/api/ambulant-clients/{clients[0]['id']}/photos/upload",
+            data={"fotografoId": "SU001"},
+            files=[("files", ("dedup.jpg", photo_bytes, "image/jpeg"))]
+        )
+        assert first.status_code == 200
+        stored = first.json()["fotosArchivos"][-1]
+        assert sha256 in stored["key"]
+        assert "sha256" not in stored
+        
+        # The same bytes sent again for another client resolve to the stored object
+        session = requests.post(f"{BASE_URL}/api/uploads", json={
+            "clientType": "ambulant", "clientId": clients[1]["id"], "fotografoId": "SU001",
+            "filename": "dedup.jpg", "size": len(photo_bytes), "contentType": "image/jpeg", "sha256": sha256
+        })
+        assert session.status_code == 201
+        upload_id = session.json()["id"]
+        assert requests.patch(f"{BASE_URL}/api/uploads/{upload_id}", data=photo_bytes, headers={"Upload-Offset": "0"}).status_code == 204
+        assert requests.post(f"{BASE_URL}/api/uploads/{upload_id}/finalize").status_code == 200
+        
+        second = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/{clients[1]['telefono']}").json()
+        assert second["fotosArchivos"][-1]["key"] == stored["key"]
+        print(f"✓ Duplicate photo resolved to {stored['key']}")
+
+
+class TestPhotoArchive:
+    """Streaming ZIP download of a client's photos"""
+    
+    def test_zip_download_and_resume(self):
+        lookup = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7870000222")
+        if lookup.status_code != 200 or not lookup.json().get("fotosZip"):
+            pytest.skip("No ambulant client with stored photos")
+        client = lookup.json()
+        client_id = client["id"]
+        
+        assert requests.get(f"{BASE_URL}/api/clients/{client_id}/photos.zip").status_code == 403
+        full = requests.get(client["fotosZip"])
+        assert full.status_code == 200
+        assert full.headers["Content-Type"] == "application/zip"
+        assert int(full.headers["Content-Length"]) == len(full.content)
+        with zipfile.ZipFile(io.BytesIO(full.content)) as archive:
+            assert archive.testzip() is None
+            assert len(archive.namelist()) == len(client["fotosArchivos"])
+        
+        resumed = requests.get(
+            client["fotosZip"],
+            headers={"Range": "bytes=100-", "If-Range": full.headers["ETag"]}
+        )
+        assert resumed.status_code == 206
+        assert resumed.content == full.content[100:]
+        print(f"✓ ZIP archive for {client_id}: {len(full.content)} bytes, resumable")
+
+
+class TestPhotoDelivery:
+    """Cached, range-capable photo delivery"""
+    
+    def test_conditional_and_range_requests(self):
+        lookup = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7870000222")
+        stored = [p for p in lookup.json().get("fotosArchivos") or [] if p["key"].startswith("sha256/")] if lookup.status_code == 200 else []
+        if not stored:
+            pytest.skip("No content-addressed photos stored")
+        url = stored[0]["url"]
+        
+        full = requests.get(url)
+        assert full.status_code == 200
+        assert "immutable" in full.headers["Cache-Control"]
+        assert full.headers["Accept-Ranges"] == "bytes"
+        
+        assert requests.get(url, headers={"If-None-Match": full.headers["ETag"]}).status_code == 304
+        assert requests.get(url, headers={"If-Modified-Since": full.headers["Last-Modified"]}).status_code == 304
+        
+        partial = requests.get(url, headers={"Range": "bytes=0-99"})
+        assert partial.status_code == 206
+        assert partial.content == full.content[:100]
+        print(f"✓ Photo delivery honors conditional and Range requests")
+
+
+class TestSignedPhotoUrls:
+    """HMAC-signed, expiring photo URLs"""
+    
+    def test_tampered_signature_rejected(self):
+        lookup = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7870000222")
+        if lookup.status_code != 200 or not lookup.json().get("fotosArchivos"):
+            pytest.skip("No stored photos for the upload test client")
+        url = lookup.json()["fotosArchivos"][0]["url"]
+        assert "s=" in url and "e=" in url
+        
+        assert requests.get(url).status_code == 200
+        assert requests.get(url.replace("c=", "c=X")).status_code == 403
+        base, _, query = url.partition("?")
+        params = dict(param.split("=", 1) for param in query.split("&"))
+        params["e"] = "1"
+        expired = requests.get(base, params=params)
+        assert expired.status_code == 403
+        print("✓ Tampered and expired photo URLs rejected")
+
+
+class TestEmailOutbox:
+    """Activation emails go through the Mongo outbox"""
+    
+    def test_approval_queues_activation_email(self):
+        application = requests.post(f"{BASE_URL}/api/staff", json={
+            "nombre": "TEST_Fotografo_Outbox",
+            "email": f"test.outbox.{int(time.time())}@example.com",
+            "telefono": "+1 787-555-0001",
+            "experiencia": "1 año",
+            "equipo": "Nikon Z6",
+            "especialidades": ["Evento"],
+            "fotosReferencia": []
+        }).json()
+        
+        response = requests.post(f"{BASE_URL}/api/staff/approve/{application['id']}")
+        assert response.status_code == 200
+        email_status = response.json()["emailStatus"]
+        assert email_status["status"] in ("queued", "skipped")
+        
+        if email_status["status"] == "queued":
+            outbox = requests.get(f"{BASE_URL}/api/admin/email-outbox").json()
+            entry = next(e for e in outbox if e["id"] == email_status["outboxId"])
+            assert entry["to"] == application["email"]
+            assert "html" not in entry
+        print(f"✓ Activation email {email_status['status']}")
+
+
+class StubResend(BaseHTTPRequestHandler):
+    """Minimal Resend API: rejects any batch addressed to an @invalid address, or fails with `fail_status`"""
+    fail_status = None
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        emails = body if isinstance(body, list) else [body]
+        if self.fail_status:
+            self.reply(self.fail_status, {"statusCode": self.fail_status, "name": "application_error", "message": "Provider down"})
+        elif any(to.endswith("@invalid") for email in emails for to in email["to"]):
+            self.reply(422, {"statusCode": 422, "name": "validation_error", "message": "Invalid `to` field"})
+        elif isinstance(body, list):
+            self.reply(200, {"data": [{"id": f"stub_{email['to'][0]}"} for email in emails]})
+        else:
+            self.reply(200, {"id": f"stub_{body['to'][0]}"})
+    
+    def reply(self, status, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
+    
+    def log_message(self, *args):
+        pass
+
+
+class TestEmailOutboxDelivery:
+    """Outbox delivery against a stub Resend server, run in-process on a scratch database"""
+    
+    @pytest.fixture
+    def outbox(self, monkeypatch):
+        pytest.importorskip("resend")
+        motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        monkeypatch.setenv("ALLOW_EPHEMERAL_PHOTO_URL_SECRET", "1")
+        import server
+        
+        stub = ThreadingHTTPServer(("127.0.0.1", 0), StubResend)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        monkeypatch.setattr(server.resend, "api_url", f"http://127.0.0.1:{stub.server_port}")
+        monkeypatch.setattr(server.resend, "api_key", "re_test")
+        monkeypatch.setattr(server, "EMAIL_MAX_ATTEMPTS", 2)
+        monkeypatch.setattr(StubResend, "fail_status", None)
+        
+        def run(scenario):
+            async def main():
+                client = motor_asyncio.AsyncIOMotorClient(server.MONGO_URL, serverSelectionTimeoutMS=2000)
+                try:
+                    await client.admin.command("ping")
+                except Exception:
+                    pytest.skip("MongoDB not reachable at MONGO_URL")
+                scratch = client[f"{server.DB_NAME}_outbox_test"]
+                monkeypatch.setattr(server, "email_outbox_collection", scratch["email_outbox"])
+                try:
+                    await scratch["email_outbox"].delete_many({})
+                    await scenario(server, scratch["email_outbox"])
+                finally:
+                    await client.drop_database(scratch.name)
+                    client.close()
+            asyncio.run(main())
+        
+        yield run
+        stub.shutdown()
+    
+    @staticmethod
+    async def deliver(server):
+        batch = await server.claim_email_batch()
+        assert batch
+        await server.deliver_email_batch(batch)
+    
+    def test_good_batch_is_sent(self, outbox):
+        async def scenario(server, collection):
+            ids = [await server.enqueue_email("test", f"guest{i}@example.com", "Hola", "<p>Hola</p>") for i in range(2)]
+            await self.deliver(server)
+            for outbox_id in ids:
+                doc = await collection.find_one({"id": outbox_id})
+                assert doc["status"] == "sent"
+                assert doc["providerId"] == f"stub_{doc['to']}"
+        outbox(scenario)
+        print("✓ Batch sent with provider ids")
+    
+    def test_server_error_backs_off_then_fails(self, outbox, monkeypatch):
+        monkeypatch.setattr(StubResend, "fail_status", 503)
+        
+        async def scenario(server, collection):
+            outbox_id = await server.enqueue_email("test", "guest@example.com", "Hola", "<p>Hola</p>")
+            queued = await collection.find_one({"id": outbox_id})
+            await self.deliver(server)
+            retried = await collection.find_one({"id": outbox_id})
+            assert retried["status"] == "pending"
+            assert retried["attempts"] == 1
+            assert retried["nextAttemptAt"] > queued["nextAttemptAt"]
+            
+            # Make it due again; the second attempt reaches EMAIL_MAX_ATTEMPTS
+            await collection.update_one({"id": outbox_id}, {"$set": {"nextAttemptAt": queued["nextAttemptAt"]}})
+            await self.deliver(server)
+            failed = await collection.find_one({"id": outbox_id})
+            assert failed["status"] == "failed"
+            assert failed["attempts"] == server.EMAIL_MAX_ATTEMPTS
+        outbox(scenario)
+        print("✓ 5xx retried with backoff, then failed")
+    
+    def test_invalid_address_fails_alone(self, outbox):
+        async def scenario(server, collection):
+            good = await server.enqueue_email("test", "guest@example.com", "Hola", "<p>Hola</p>")
+            bad = await server.enqueue_email("test", "nobody@invalid", "Hola", "<p>Hola</p>")
+            await self.deliver(server)
+            assert (await collection.find_one({"id": good}))["status"] == "sent"
+            rejected = await collection.find_one({"id": bad})
+            assert rejected["status"] == "failed"
+            assert rejected["attempts"] == 1
+        outbox(scenario)
+        print("✓ Invalid address failed without holding back the batch")
+
+
+class TestPhoneLookup:
+    """E.164-normalized phone lookups"""
+    
+    def test_lookup_tolerates_formatting(self):
+        zones = requests.get(f"{BASE_URL}/api/zones/active").json()
+        if not zones:
+            pytest.skip("No active zones available")
+        created = requests.post(f"{BASE_URL}/api/ambulant-clients", json={
+            "nombre": "TEST_Cliente_Telefono", "telefono": "(787) 000-0444", "zonaId": zones[0]["id"]
+        }).json()
+        assert created["telefonoE164"] == "+17870000444"
+        
+        for variant in ["7870000444", "787-000-0444", "+1 787 000 0444", "1.787.000.0444"]:
+            response = requests.get(f"{BASE_URL}/api/ambulant-clients/phone/{variant}")
+            assert response.status_code == 200, variant
+            assert response.json()["id"] == created["id"]
+        print("✓ Phone lookup matched every formatting variant")
+    
+    def test_unknown_and_invalid_phones(self):
+        assert requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7879990001").status_code == 404
+        assert requests.get(f"{BASE_URL}/api/activity-clients/phone/12").status_code == 404
+        print("✓ Unknown phones return 404")
+
+
+class TestClientLookup:
+    """Unified lookup across ambulant and activity clients"""
+    
+    def test_lookup_returns_both_registrations(self):
+        zones = requests.get(f"{BASE_URL}/api/zones/active").json()
+        activities = requests.get(f"{BASE_URL}/api/activities/active").json()
+        if not zones or not activities:
+            pytest.skip("Need an active zone and activity")
+        ambulant = requests.post(f"{BASE_URL}/api/ambulant-clients", json={
+            "nombre": "TEST_Cliente_Ambos", "telefono": "787-000-0555", "zonaId": zones[0]["id"]
+        }).json()
+        activity = requests.post(f"{BASE_URL}/api/activity-clients", json={
+            "nombre": "TEST_Cliente_Ambos", "telefono": "+1 (787) 000-0555",
+            "negocioId": activities[0]["negocioId"], "actividadId": activities[0]["id"]
+        }).json()
+        
+        response = requests.get(f"{BASE_URL}/api/clients/lookup", params={"phone": "7870000555"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["telefonoE164"] == "+17870000555"
+        assert ambulant["id"] in [c["id"] for c in data["ambulantes"]]
+        match = next(c for c in data["actividades"] if c["id"] == activity["id"])
+        assert match["negocioNombre"] and match["actividadNombre"]
+        print(f"✓ Lookup found {len(data['ambulantes'])} ambulant and {len(data['actividades'])} activity registrations")
+    
+    def test_lookup_unknown_phone(self):
+        response = requests.get(f"{BASE_URL}/api/clients/lookup", params={"phone": "7879990002"})
+        assert response.status_code == 404
+        print("✓ Unknown phone returns 404")
+
+
+# Per-IP limits are opt-in on the server; the throttle test only runs when the
+# environment under test enables them and tells us the lookup burst.
+LOOKUP_BURST = int(os.environ.get('RATE_LIMIT_LOOKUP_BURST', '30'))
+LOOKUP_LIMITED = float(os.environ.get('RATE_LIMIT_LOOKUP_PER_MINUTE', '0')) > 0
+
+
+class TestRateLimiting:
+    """Per-IP token buckets on public lookup endpoints"""
+    
+    @pytest.mark.skipif(not LOOKUP_LIMITED, reason="RATE_LIMIT_LOOKUP_PER_MINUTE not set for the server under test")
+    def test_lookup_burst_is_throttled(self):
+        attempts = LOOKUP_BURST + 10
+        responses = [
+            requests.get(f"{BASE_URL}/api/clients/lookup", params={"phone": "7879990003"})
+            for _ in range(attempts)
+        ]
+        throttled = [r for r in responses if r.status_code == 429]
+        assert throttled, "Expected the lookup burst to be throttled"
+        retry_after = int(throttled[0].headers["Retry-After"])
+        assert retry_after >= 1
+        # Let the bucket refill so later lookups are not affected
+        time.sleep(retry_after)
+        response = requests.get(f"{BASE_URL}/api/clients/lookup", params={"phone": "7879990003"})
+        assert response.status_code == 404
+        print(f"✓ {len(throttled)} of {attempts} lookups throttled, Retry-After {retry_after}s")
+    
+    def test_catalog_endpoints_not_throttled(self):
+        for _ in range(30):
+            response = requests.get(f"{BASE_URL}/api/zones/active")
+            assert response.status_code == 200
+        print("✓ Catalog endpoints are not rate limited")
+
+
+class TestResponseModels:
+    """Declared response models shape every JSON payload"""
+    
+    def test_client_list_matches_model(self):
+        response = requests.get(f"{BASE_URL}/api/ambulant-clients?limit=20")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
+        for client in response.json():
+            assert "_id" not in client
+            for field in ("id", "nombre", "telefono", "zonaId", "status", "telefonoE164", "fotosArchivos"):
+                assert field in client
+        print("✓ Client list items follow AmbulantClientResponse")
+    
+    def test_message_and_staff_payloads(self):
+        response = requests.get(f"{BASE_URL}/api/health")
+        assert response.json() == {"status": "healthy", "service": "Fotos Express API"}
+        users = requests.get(f"{BASE_URL}/api/staff/users").json()
+        for user in users:
+            assert "password_hash" not in user and "activationToken" not in user
+            assert "tokenExpires" in user
+        print("✓ Health and staff user payloads follow their models")
+    
+    def test_snapshot_keeps_its_shape(self):
+        counts = requests.get(f"{BASE_URL}/api/admin/snapshot", params={"countsOnly": "true"}).json()
+        assert set(counts) == {"counts", "cursors"}
+        snapshot = requests.get(f"{BASE_URL}/api/admin/snapshot", params={"limit": 5}).json()
+        assert set(counts["counts"]) <= set(snapshot)
+        for client in snapshot["ambulantClients"]:
+            assert "fotografoAsignado" in client
+        print("✓ Snapshot sections keep their null fields")
+
+
+class TestCompression:
+    """Accept-Encoding negotiated compression"""
+    
+    def test_large_list_is_compressed(self):
+        response = requests.get(f"{BASE_URL}/api/activities", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        if len(response.content) >= 1024:
+            assert response.headers.get("Content-Encoding") == "gzip"
+            assert "Accept-Encoding" in response.headers.get("Vary", "")
+        assert isinstance(response.json(), list)
+        print(f"✓ Activities list: {len(response.content)} bytes, encoding {response.headers.get('Content-Encoding')}")
+    
+    def test_identity_is_not_compressed(self):
+        response = requests.get(f"{BASE_URL}/api/activities", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        print("✓ identity responses are sent uncompressed")
+    
+    def test_small_response_is_not_compressed(self):
+        response = requests.get(f"{BASE_URL}/api/health", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+        print("✓ Small responses skip compression")
+
+
+class TestPoolStats:
+    """Connection pool and threadpool saturation stats"""
+    
+    def test_pool_stats_shape(self):
+        response = requests.get(f"{BASE_URL}/api/admin/pools")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["mongo"]["maxPoolSize"] >= 1
+        assert data["mongo"]["inUse"] >= 0
+        for pool in ("motorExecutor", "threadpool"):
+            assert data[pool]["maxWorkers"] >= 1
+            assert data[pool]["queued"] >= 0
+        assert data["starletteThreads"]["totalTokens"] >= 1
+        print(f"✓ Mongo pool in use {data['mongo']['inUse']}/{data['mongo']['maxPoolSize']}, "
+              f"checkout wait max {data['mongo']['checkoutWait']['maxSeconds']}s")
+
+
+class TestMetrics:
+    """Prometheus metrics endpoint"""
+    
+    def test_metrics_use_route_templates(self):
+        requests.get(f"{BASE_URL}/api/ambulant-clients/phone/7879990004")
+        response = requests.get(f"{BASE_URL}/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'route="/api/ambulant-clients/phone/{phone}"' in text
+        assert "7879990004" not in text
+        for name in ("http_request_duration_seconds_bucket", "http_requests_in_flight",
+                     "mongodb_command_duration_seconds", "reference_cache_hit_ratio"):
+            assert name in text
+        print("✓ /metrics exposes route-template, Mongo and cache metrics")
+
+
+class TestSlowQueryLog:
+    """Slow-query log browsing"""
+    
+    def test_slow_queries_endpoint(self):
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries?limit=20")
+        assert response.status_code == 200
+        assert "X-Total-Count" in response.headers
+        for entry in response.json():
+            assert entry["durationMs"] >= 0
+            assert entry["collection"] and entry["command"]
+            if entry.get("explain"):
+                assert "plan" in entry["explain"]
+        print(f"✓ {response.headers['X-Total-Count']} slow queries recorded")
+    
+    def test_slow_queries_filter_by_plan(self):
+        response = requests.get(f"{BASE_URL}/api/admin/slow-queries", params={"plan": "collscan"})
+        assert response.status_code == 200
+        assert all(e["explain"]["plan"] == "COLLSCAN" for e in response.json())
+        print("✓ Slow queries filter by plan")
+
+
+# S3Storage runs against a real S3-compatible endpoint (MinIO, LocalStack)
+# when one is configured; the bucket must already exist.
+S3_TEST_ENDPOINT_URL = os.environ.get('S3_TEST_ENDPOINT_URL')
+S3_TEST_BUCKET = os.environ.get('S3_TEST_BUCKET', 'fotos-express-test')
+
+
+class TestS3Storage:
+    """S3 photo storage backend"""
+    
+    @pytest.mark.skipif(not S3_TEST_ENDPOINT_URL, reason="S3_TEST_ENDPOINT_URL not set")
+    def test_put_read_range_and_delete(self, monkeypatch, tmp_path):
+        pytest.importorskip("boto3")
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        monkeypatch.setenv("ALLOW_EPHEMERAL_PHOTO_URL_SECRET", "1")
+        import server
+        monkeypatch.setattr(server, "S3_ENDPOINT_URL", S3_TEST_ENDPOINT_URL)
+        storage = server.S3Storage(S3_TEST_BUCKET)
+        
+        photo_bytes = os.urandom(6 * 1024 * 1024 + 123)  # Two multipart parts
+        source = tmp_path / "photo.jpg"
+        source.write_bytes(photo_bytes)
+        key = f"tests/{os.urandom(8).hex()}.jpg"
+        
+        async def read(start=0, end=None):
+            return b"".join([chunk async for chunk in storage.open(key, start, end)])
+        
+        async def scenario():
+            await storage.put_file(key, str(source), "image/jpeg")
+            try:
+                assert await storage.exists(key)
+                assert await read() == photo_bytes
+                assert await read(100, 200) == photo_bytes[100:200]
+                assert await read(len(photo_bytes) - 10) == photo_bytes[-10:]
+            finally:
+                await storage.delete(key)
+            assert not await storage.exists(key)
+        
+        asyncio.run(scenario())
+        print(f"✓ S3 object {key} stored, read by range and deleted")
+
+
 # Cleanup test data
 class TestCleanup:
     """Cleanup test-created data"""
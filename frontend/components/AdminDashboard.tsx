@@ -12,7 +12,7 @@ interface ApprovalModalData {
   nombre: string;
   email: string;
   activationLink?: string;
-  emailStatus?: { status: string; message?: string };
+  emailStatus?: { status: string; message?: string; outboxId?: string };
 }
 
 const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
@@ -52,24 +52,18 @@ const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
 
   const loadData = async () => {
     try {
-      const [zRes, bRes, aRes, acRes, ecRes, sRes, stRes, suRes] = await Promise.all([
-        fetch(`${API_URL}/api/zones`),
-        fetch(`${API_URL}/api/businesses`),
-        fetch(`${API_URL}/api/activities`),
-        fetch(`${API_URL}/api/ambulant-clients`),
-        fetch(`${API_URL}/api/activity-clients`),
-        fetch(`${API_URL}/api/services`),
-        fetch(`${API_URL}/api/staff`),
-        fetch(`${API_URL}/api/staff/users`)
-      ]);
-      if (zRes.ok) setZones(await zRes.json());
-      if (bRes.ok) setBusinesses(await bRes.json());
-      if (aRes.ok) setActivities(await aRes.json());
-      if (acRes.ok) setAmbulantClients(await acRes.json());
-      if (ecRes.ok) setActivityClients(await ecRes.json());
-      if (sRes.ok) setServiceRequests(await sRes.json());
-      if (stRes.ok) setStaffApplications((await stRes.json()).filter((s: StaffApplication) => s.status === 'pendiente'));
-      if (suRes.ok) setStaffUsers(await suRes.json());
+      // Single aggregated request instead of one per collection
+      const res = await fetch(`${API_URL}/api/admin/snapshot`);
+      if (!res.ok) return;
+      const snapshot = await res.json();
+      setZones(snapshot.zones);
+      setBusinesses(snapshot.businesses);
+      setActivities(snapshot.activities);
+      setAmbulantClients(snapshot.ambulantClients);
+      setActivityClients(snapshot.activityClients);
+      setServiceRequests(snapshot.services);
+      setStaffApplications(snapshot.staff.filter((s: StaffApplication) => s.status === 'pendiente'));
+      setStaffUsers(snapshot.staffUsers);
     } catch (err) {
       console.error('Error loading data:', err);
     }
@@ -700,9 +694,9 @@ const AdminDashboard: React.FC<AdminDashboardProps> = ({ onNavigate }) => {
               </div>
 
               {approvalModal.emailStatus && (
-                <div className={`p-4 rounded-xl ${approvalModal.emailStatus.status === 'success' ? 'bg-success/10' : 'bg-warning/10'}`}>
-                  <p className={`text-[10px] font-black uppercase ${approvalModal.emailStatus.status === 'success' ? 'text-success' : 'text-warning'}`}>
-                    {approvalModal.emailStatus.status === 'success' ? 'Email enviado' : 'Email no enviado - Comparte el link manualmente'}
+                <div className={`p-4 rounded-xl ${approvalModal.emailStatus.status === 'queued' ? 'bg-success/10' : 'bg-warning/10'}`}>
+                  <p className={`text-[10px] font-black uppercase ${approvalModal.emailStatus.status === 'queued' ? 'text-success' : 'text-warning'}`}>
+                    {approvalModal.emailStatus.status === 'queued' ? 'Email en cola de envío' : 'Email no enviado - Comparte el link manualmente'}
                   </p>
                 </div>
               )}
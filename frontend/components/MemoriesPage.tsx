@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { AppView, AmbulantClient, ActivityClient, Business, Activity, Zone } from '../types';
+import { AppView, AmbulantClient, ActivityClient, ClientLookup, Business, Activity, Zone, PhotoVariant } from '../types';
 
 interface MemoriesPageProps {
   onNavigate: (view: AppView) => void;
@@ -61,28 +61,33 @@ const MemoriesPage: React.FC<MemoriesPageProps> = ({ onNavigate }) => {
     setActivityResult(null);
     setIsSearching(true);
 
-    const fullPhone = phone.replace(/\D/g, '');
+    const digits = phone.replace(/\D/g, '');
+    const countryDigits = countryCode.replace(/\D/g, '');
+    // NANP numbers typed with their area code (+1-809 or otherwise) only need the +1
+    const fullPhone = encodeURIComponent(
+      countryDigits.startsWith('1') && digits.length === 10 ? `+1${digits}` : `+${countryDigits}${digits}`
+    );
+
+    if (activeTab === 'actividad' && (!selectedBusiness || !selectedActivity)) {
+      setError('Por favor selecciona el negocio y la actividad.');
+      setIsSearching(false);
+      return;
+    }
 
     try {
-      if (activeTab === 'ambulante') {
-        const res = await fetch(`${API_URL}/api/ambulant-clients/phone/${fullPhone}`);
-        if (res.ok) {
-          setAmbulantResult(await res.json());
-        } else {
-          setError('No encontramos fotos asociadas a este número. Verifica e intenta de nuevo.');
-        }
-      } else {
-        if (!selectedBusiness || !selectedActivity) {
-          setError('Por favor selecciona el negocio y la actividad.');
-          setIsSearching(false);
-          return;
-        }
-        const res = await fetch(`${API_URL}/api/activity-clients/phone/${fullPhone}?negocioId=${selectedBusiness}&actividadId=${selectedActivity}`);
-        if (res.ok) {
-          setActivityResult(await res.json());
-        } else {
-          setError('No encontramos fotos asociadas a este número en esta actividad.');
-        }
+      // One call returns both zone and event registrations, so switching tabs needs no new request
+      const res = await fetch(`${API_URL}/api/clients/lookup?phone=${fullPhone}`);
+      const lookup: ClientLookup | null = res.ok ? await res.json() : null;
+      const ambulant = lookup?.ambulantes[0] || null;
+      const activity = lookup?.actividades.find(
+        c => c.negocioId === selectedBusiness && c.actividadId === selectedActivity
+      ) || null;
+      setAmbulantResult(ambulant);
+      setActivityResult(activity);
+      if (activeTab === 'ambulante' && !ambulant) {
+        setError('No encontramos fotos asociadas a este número. Verifica e intenta de nuevo.');
+      } else if (activeTab === 'actividad' && !activity) {
+        setError('No encontramos fotos asociadas a este número en esta actividad.');
       }
     } catch (err) {
       setError('Error de conexión. Intenta de nuevo.');
@@ -94,6 +99,13 @@ const MemoriesPage: React.FC<MemoriesPageProps> = ({ onNavigate }) => {
   const currentResult = activeTab === 'ambulante' ? ambulantResult : activityResult;
   const currentPhotos = currentResult?.fotosSubidas || [];
 
+  // Resized derivatives (when the backend has generated them) keyed by original URL
+  const derivativesByUrl = new Map(
+    (currentResult?.fotosArchivos || []).map(photo => [photo.url, photo.derivados])
+  );
+  const variantOf = (url: string, size: 'thumb' | 'gallery' | 'download'): PhotoVariant | undefined =>
+    derivativesByUrl.get(url)?.[size];
+
   const resetSearch = () => {
     setAmbulantResult(null);
     setActivityResult(null);
@@ -153,7 +165,10 @@ const MemoriesPage: React.FC<MemoriesPageProps> = ({ onNavigate }) => {
                     onClick={() => setLightboxIndex(idx)}
                     className="aspect-[4/5] rounded-2xl overflow-hidden cursor-pointer group relative bg-background-input border border-white/5"
                   >
-                    <img src={url} alt={`Foto ${idx + 1}`} className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-110" />
+                    <picture>
+                      {variantOf(url, 'thumb') && <source srcSet={variantOf(url, 'thumb')!.webp} type="image/webp" />}
+                      <img src={variantOf(url, 'thumb')?.jpeg || url} alt={`Foto ${idx + 1}`} loading="lazy" className="w-full h-full object-cover transition-transform duration-500 group-hover:scale-110" />
+                    </picture>
                     <div className="absolute inset-0 bg-black/0 group-hover:bg-black/40 transition-all flex items-center justify-center opacity-0 group-hover:opacity-100">
                       <span className="material-symbols-outlined text-white text-3xl">zoom_in</span>
                     </div>
@@ -162,6 +177,17 @@ const MemoriesPage: React.FC<MemoriesPageProps> = ({ onNavigate }) => {
               </div>
             </div>
 
+            {currentResult.fotosZip && (
+              <a
+                href={currentResult.fotosZip}
+                download
+                className="w-full mb-4 flex items-center justify-center gap-2 bg-gradient-logo text-background font-black py-5 rounded-2xl uppercase tracking-widest text-xs hover:scale-[1.02] transition-all"
+              >
+                <span className="material-symbols-outlined text-lg">folder_zip</span>
+                DESCARGAR TODAS ({currentResult.fotosArchivos?.length})
+              </a>
+            )}
+
             <button 
               onClick={resetSearch}
               className="w-full bg-white/5 text-white font-black py-5 rounded-2xl uppercase tracking-widest text-xs hover:bg-white/10 transition-all"
@@ -363,19 +389,24 @@ const MemoriesPage: React.FC<MemoriesPageProps> = ({ onNavigate }) => {
               </button>
             )}
 
-            <img
-              src={currentPhotos[lightboxIndex]}
-              alt="Foto HD"
-              className="max-w-full max-h-[85vh] object-contain rounded-2xl shadow-2xl"
-              onClick={(e) => e.stopPropagation()}
-            />
+            <picture>
+              {variantOf(currentPhotos[lightboxIndex], 'gallery') && (
+                <source srcSet={variantOf(currentPhotos[lightboxIndex], 'gallery')!.webp} type="image/webp" />
+              )}
+              <img
+                src={variantOf(currentPhotos[lightboxIndex], 'gallery')?.jpeg || currentPhotos[lightboxIndex]}
+                alt="Foto HD"
+                className="max-w-full max-h-[85vh] object-contain rounded-2xl shadow-2xl"
+                onClick={(e) => e.stopPropagation()}
+              />
+            </picture>
 
             <div className="absolute bottom-6 left-1/2 -translate-x-1/2 flex items-center gap-4">
               <span className="text-white/60 text-[10px] font-black uppercase tracking-widest">
                 {lightboxIndex + 1} / {currentPhotos.length}
               </span>
               <a
-                href={currentPhotos[lightboxIndex]}
+                href={variantOf(currentPhotos[lightboxIndex], 'download')?.jpeg || currentPhotos[lightboxIndex]}
                 download
                 onClick={(e) => e.stopPropagation()}
                 className="bg-primary text-background px-6 py-3 rounded-xl font-black text-[10px] uppercase tracking-widest flex items-center gap-2 hover:scale-105 transition-all"
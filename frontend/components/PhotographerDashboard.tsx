@@ -7,6 +7,65 @@ interface PhotographerDashboardProps {
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || '';
 
+// Resumable uploads: the file goes up in chunks and, after a dropped
+// connection, resumes from the offset the server already has.
+const UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 8;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+const uploadResumable = async (
+  file: File,
+  target: { id: string; type: 'ambulante' | 'actividad' },
+  fotografoId: string,
+  onProgress: (offset: number) => void
+) => {
+  // Lets the server reject an upload whose bytes arrived corrupted
+  const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  const sha256 = Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+
+  const createRes = await fetch(`${API_URL}/api/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      clientType: target.type === 'ambulante' ? 'ambulant' : 'activity',
+      clientId: target.id,
+      fotografoId,
+      filename: file.name,
+      size: file.size,
+      contentType: file.type || 'image/jpeg',
+      sha256
+    })
+  });
+  if (!createRes.ok) throw new Error(await createRes.text());
+  const { id } = await createRes.json();
+
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    try {
+      const res = await fetch(`${API_URL}/api/uploads/${id}`, {
+        method: 'PATCH',
+        headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+        body: file.slice(offset, offset + UPLOAD_CHUNK_BYTES)
+      });
+      if (!res.ok && res.status !== 409) throw new Error(await res.text());
+      offset = Number(res.headers.get('Upload-Offset'));
+      retries = 0;
+    } catch (err) {
+      if (++retries > UPLOAD_MAX_RETRIES) throw err;
+      await sleep(Math.min(1000 * 2 ** retries, 30000));
+      // Ask the server how much actually arrived before resuming
+      const head = await fetch(`${API_URL}/api/uploads/${id}`, { method: 'HEAD' }).catch(() => null);
+      if (head?.ok) offset = Number(head.headers.get('Upload-Offset'));
+    }
+    onProgress(offset);
+  }
+
+  const finalizeRes = await fetch(`${API_URL}/api/uploads/${id}/finalize`, { method: 'POST' });
+  if (!finalizeRes.ok) throw new Error(await finalizeRes.text());
+};
+
 const PhotographerDashboard: React.FC<PhotographerDashboardProps> = ({ onNavigate }) => {
   const [activeTab, setActiveTab] = useState<'ambulantes' | 'actividades' | 'profile'>('ambulantes');
   const [isSidebarOpen, setIsSidebarOpen] = useState(false);
@@ -69,43 +128,28 @@ const PhotographerDashboard: React.FC<PhotographerDashboardProps> = ({ onNavigat
     if (!selectedFiles || selectedFiles.length === 0 || !uploadingClient || !staffUser) return;
 
     setIsUploading(true);
-    
-    // Simulate upload progress
-    let currentProgress = 0;
-    const interval = setInterval(() => {
-      currentProgress += 10;
-      setProgress(currentProgress);
-      if (currentProgress >= 100) {
-        clearInterval(interval);
-        setTimeout(async () => {
-          // Generate mock photo URLs
-          const mockPhotos = Array.from({ length: selectedFiles.length }, (_, i) => 
-            `https://picsum.photos/id/${Math.floor(Math.random() * 200) + 20}/800/1000`
-          );
-          
-          try {
-            const endpoint = uploadingClient.type === 'ambulante' 
-              ? `/api/ambulant-clients/${uploadingClient.id}/photos`
-              : `/api/activity-clients/${uploadingClient.id}/photos`;
-            
-            await fetch(`${API_URL}${endpoint}`, {
-              method: 'PUT',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ fotos: mockPhotos, fotografoId: staffUser.id })
-            });
-            
-            // Reload clients
-            loadClients(staffUser.id);
-          } catch (err) {
-            console.error('Error uploading:', err);
-          }
-
-          setUploadingClient(null);
-          setSelectedFiles(null);
-          setIsUploading(false);
-        }, 500);
+    setProgress(0);
+
+    const files = Array.from(selectedFiles);
+    const totalBytes = files.reduce((sum, file) => sum + file.size, 0);
+    let uploadedBefore = 0;
+
+    try {
+      for (const file of files) {
+        await uploadResumable(file, uploadingClient, staffUser.id, (offset) =>
+          setProgress(Math.round(((uploadedBefore + offset) / totalBytes) * 100))
+        );
+        uploadedBefore += file.size;
       }
-    }, 80);
+      setProgress(100);
+      loadClients(staffUser.id);
+    } catch (err) {
+      console.error('Error uploading:', err);
+    }
+
+    setUploadingClient(null);
+    setSelectedFiles(null);
+    setIsUploading(false);
   };
 
   const handleChangePassword = async (e: React.FormEvent) => {
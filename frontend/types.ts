@@ -39,6 +39,24 @@ export interface Activity {
   fotografosAsignados: string[];
 }
 
+// Stored photo (uploaded through the backend)
+export interface PhotoVariant {
+  width: number;
+  height: number;
+  webp: string;
+  jpeg: string;
+}
+
+export interface StoredPhoto {
+  key: string;
+  url: string;
+  nombre?: string;
+  size: number;
+  contentType?: string;
+  subidaEn?: string;
+  derivados?: Record<'thumb' | 'gallery' | 'download', PhotoVariant>;
+}
+
 // Ambulant Client
 export interface AmbulantClient {
   id: string;
@@ -52,6 +70,8 @@ export interface AmbulantClient {
   status: 'esperando_fotos' | 'atendido';
   fotografoAsignado?: string;
   fotosSubidas?: string[];
+  fotosArchivos?: StoredPhoto[];
+  fotosZip?: string;
   fechaRegistro?: string;
 }
 
@@ -68,9 +88,18 @@ export interface ActivityClient {
   status: 'esperando_fotos' | 'atendido';
   fotografoAsignado?: string;
   fotosSubidas?: string[];
+  fotosArchivos?: StoredPhoto[];
+  fotosZip?: string;
   fechaRegistro?: string;
 }
 
+// Unified phone lookup
+export interface ClientLookup {
+  telefonoE164: string;
+  ambulantes: AmbulantClient[];
+  actividades: ActivityClient[];
+}
+
 // Service Request
 export interface ServiceRequest {
   id: string;